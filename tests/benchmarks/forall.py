@@ -0,0 +1,70 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+"""
+Times finding forall's files in a generated tree with a .git
+full of objects: a plain os.walk the way forall used to, the
+streaming walk, then the FileIndex cold (nothing in .vellum/files), warm (a new build
+reading the saved index), and again in the same build.
+
+Usage: python tests/benchmarks/forall.py [dirs] [files]
+"""
+
+from vellum.index import FileIndex, walk as stream
+from vellum.stats import StatCache
+from vellum.store import Store
+import fnmatch
+import os
+import shutil
+import sys
+import time
+
+ROOT = "/tmp/vellum_forall_bench"
+
+def generate(dirs, files):
+    """Makes dirs source directories of files each, and a big .git."""
+    if os.path.exists(ROOT): shutil.rmtree(ROOT)
+    for top in ["src", ".git/objects"]:
+        for d in range(dirs):
+            path = os.path.join(ROOT, top, "d%d" % d)
+            os.makedirs(path)
+            for f in range(files):
+                open(os.path.join(path, "f%d.py" % f), "w").close()
+    old = time.time() - 10
+    for path, subdirs, fnames in os.walk(ROOT):
+        os.utime(path, (old, old))
+
+def walk(pattern):
+    matches = []
+    for path, dirs, fnames in os.walk(ROOT):
+        matches.extend(fnmatch.filter([os.path.join(path, f) for f in fnames], pattern))
+    return matches
+
+def timed(func, *args):
+    start = time.time()
+    found = func(*args)
+    count = len(found) if isinstance(found, list) else sum([1 for f in found])
+    return (time.time() - start) * 1000, count
+
+def main(dirs=200, files=50):
+    generate(int(dirs), int(files))
+    store = ROOT + "_store"
+    if os.path.exists(store): shutil.rmtree(store)
+
+    print "%-18s %9s %7s" % ("", "time", "files")
+    print "%-18s %7.1fms %7d" % (("os.walk",) + timed(walk, "*.py"))
+    print "%-18s %7.1fms %7d" % (("streamed",) + timed(stream, ROOT, "*.py"))
+
+    index = FileIndex(StatCache(), Store("files", store))
+    print "%-18s %7.1fms %7d" % (("index cold",) + timed(index.files, ROOT, "*.py"))
+    index.save()
+
+    index = FileIndex(StatCache(), Store("files", store))
+    print "%-18s %7.1fms %7d" % (("index warm",) + timed(index.files, ROOT, "*.py"))
+    print "%-18s %7.1fms %7d" % (("same build",) + timed(index.files, ROOT, "*.py"))
+    print "%-18s %7.1fms %7d" % (("pruned to src/d7",) +
+                                 timed(index.files, ROOT, ROOT + "/src/d7/*.py"))
+    shutil.rmtree(ROOT)
+    shutil.rmtree(store)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
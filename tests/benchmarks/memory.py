@@ -0,0 +1,60 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+"""
+Measures how many bytes each target of a generated spec costs
+before and after Press compacts it.  The "before" spec swaps in
+a Reference with a plain __dict__ like the old one had.
+
+Usage: python tests/benchmarks/memory.py [targets]
+"""
+
+from parse import generate
+from vellum.parser import parse_tokens, Reference
+from vellum.press import compact
+import sys
+
+class DictReference(object):
+    def __init__(self, name, expr):
+        self.name = name
+        self.expr = expr
+
+def unfreeze(value):
+    """Rebuilds a parsed value the way the parser used to give it."""
+    if isinstance(value, list):
+        return [unfreeze(v) for v in value]
+    elif isinstance(value, dict):
+        return dict([(k, unfreeze(v)) for k, v in value.items()])
+    elif isinstance(value, Reference):
+        return DictReference(value.name, unfreeze(value.expr))
+    else:
+        return value
+
+def deep_size(value, seen=None):
+    """Sizes everything reachable from value, counting shared objects once."""
+    seen = set() if seen is None else seen
+    if id(value) in seen: return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+
+    if isinstance(value, (list, tuple)):
+        size += sum([deep_size(v, seen) for v in value])
+    elif isinstance(value, dict):
+        size += sum([deep_size(k, seen) + deep_size(v, seen)
+                     for k, v in value.items()])
+    elif hasattr(value, "__dict__"):
+        size += deep_size(value.__dict__, seen)
+    elif hasattr(value, "__slots__"):
+        size += sum([deep_size(getattr(value, s), seen) for s in value.__slots__])
+    return size
+
+def main(targets=5000):
+    targets = int(targets)
+    before = deep_size(unfreeze(parse_tokens('input', generate(targets))))
+    after = deep_size(compact(parse_tokens('input', generate(targets))))
+    print "%d targets:" % targets
+    print "  plain     %6d bytes/target" % (before / targets)
+    print "  compact   %6d bytes/target  %4.1f%% smaller" % (
+            after / targets, 100.0 * (before - after) / before)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
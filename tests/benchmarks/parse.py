@@ -0,0 +1,48 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+"""
+Times parsing a generated multi-megabyte .vel file with the
+generated ParserScanner and with the single pass TokenScanner,
+and checks that both give the same spec.
+
+Usage: python tests/benchmarks/parse.py [targets]
+"""
+
+from vellum.parser import Parser, ParserScanner, wrap_error_reporter
+from vellum.scanner import TokenScanner
+import sys
+import time
+
+TARGET = """
+        target%(i)d [
+            $ cc -c -o build/file%(i)d.o src/file%(i)d.c
+            log "built file%(i)d with \\"cc\\""
+            py 'print "%(i)d"'
+            forall(files "*.%(i)d" do [
+                $ touch %%(file)s
+            ])
+            gen(input 'in%(i)d.txt' output 'out%(i)d.txt' count %(i)d)
+        ]
+"""
+
+def generate(targets):
+    """Makes a spec with an options stanza and lots of targets."""
+    body = "".join([TARGET % {"i": i} for i in range(targets)])
+    return "# generated\noptions(default 'target0')\ntargets(%s)\n\0" % body
+
+def time_parse(scanner, text):
+    start = time.time()
+    spec = wrap_error_reporter(Parser(scanner(text)), 'input')
+    return time.time() - start, spec
+
+def main(targets=20000):
+    text = generate(int(targets))
+    print "%d targets, %.1fMB of .vel:" % (int(targets), len(text) / 1048576.0)
+    old, old_spec = time_parse(ParserScanner, text)
+    new, new_spec = time_parse(TokenScanner, text)
+    assert new_spec and repr(old_spec) == repr(new_spec), "scanners gave different specs"
+    print "  ParserScanner  %6.2fs" % old
+    print "  TokenScanner   %6.2fs  %4.1fx" % (new, old / new)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,45 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+"""
+Times a big forall: options with hundreds of keys and a scope
+pushed, interpolated against, and popped for each of many files,
+once with the old dict copies and once with Scope.
+
+Usage: python tests/benchmarks/scope.py [options] [files]
+"""
+
+from vellum.scribe import Scribe
+from vellum.script import Script
+import sys
+import time
+
+class CopyScribe(Scribe):
+    """A Scribe that pushes scopes the way it used to."""
+
+    def push_scope(self, vars={}):
+        self.stack.append(self.options)
+        self.options = self.options.copy()
+        self.options.update(vars)
+
+def forall(scribe, files):
+    names = ["src/f%d.py" % i for i in xrange(files)]
+    start = time.time()
+    for name in names:
+        scribe.push_scope({"file": name, "var": "file"})
+        scribe.interpolate("sh", "lint %(file)s --opt %(opt7)s")
+        scribe.pop_scope()
+    return (time.time() - start) * 1000
+
+def main(options=300, files=20000):
+    script = Script("build")
+    for i in range(int(options)):
+        script.options["opt%d" % i] = "value%d" % i
+
+    print "%d options, %d files:" % (len(script.options), int(files))
+    copies = forall(CopyScribe(script), int(files))
+    layers = forall(Scribe(script), int(files))
+    print "  dict copies %8.1fms" % copies
+    print "  Scope       %8.1fms  %4.1fx faster" % (layers, copies / layers)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,56 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+"""
+Times one target with hundreds of plain shell lines run the
+normal way through /bin/sh, exec'd directly with the direct
+option, and streamed into one persistent shell.
+
+Usage: python tests/benchmarks/spawn.py [lines]
+"""
+
+from vellum.script import Script
+from vellum.scribe import Scribe
+import os
+import sys
+import tempfile
+import time
+
+SPEC = """
+options(default 'spawn')
+depends()
+targets(
+    spawn [
+%s    ]
+)
+"""
+
+def write_spec(lines):
+    """Makes a build spec in a temp dir, returning its name without .vel."""
+    root = tempfile.mkdtemp()
+    body = "".join(["        $ env true %d\n" % i for i in range(lines)])
+    open(os.path.join(root, "spawn.vel"), "w").write(SPEC % body)
+    return os.path.join(root, "spawn")
+
+def time_build(spec, **options):
+    options["verbose"] = False
+    scribe = Scribe(Script(spec, options))
+    start = time.time()
+    scribe.build(["spawn"])
+    return time.time() - start
+
+def main(lines=500):
+    spec = write_spec(int(lines))
+    modes = [("/bin/sh per line", {}),
+             ("direct exec", {"direct": True}),
+             ("persistent shell", {"persistent": True})]
+
+    print "%d lines in one target:" % int(lines)
+    base = None
+    for name, options in modes:
+        took = time_build(spec, **options)
+        base = base or took
+        print "  %-18s %6.3fs  %6.1fus/line  %4.1fx" % (name, took, 
+                took / int(lines) * 1000000, base / took)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,89 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+"""
+Times how long each mode of the vellum command takes to start and
+finish, cold (no .vellum parse or command caches) and warm, and
+checks the warm times against startup_budget.txt next to this file.
+Python 2 has no -X importtime, so with -i it also runs each mode once
+under an import hook and prints the slowest imports.  Exits with 1 if
+anything is over budget.
+
+Usage: python tests/benchmarks/startup.py [-i] [runs]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.txt")
+CACHES = [".vellum/recipes", ".vellum/commands"]
+
+# runs vellum.bin the way bin/vellum does, but timing every first
+# import (including the ones inside it) along the way
+IMPORT_TIMER = """
+import __builtin__, sys, time
+real_import = __builtin__.__import__
+times = []
+def timed_import(name, *args):
+    if name in sys.modules: return real_import(name, *args)
+    start = time.time()
+    try:
+        return real_import(name, *args)
+    finally:
+        times.append((time.time() - start, name))
+__builtin__.__import__ = timed_import
+import vellum.bin
+vellum.bin.run(sys.argv[1:])
+__builtin__.__import__ = real_import
+times.sort(reverse=True)
+sys.stderr.write("".join(["%8.1fms  %s\\n" % (t * 1000, n) for t, n in times[:10]]))
+"""
+
+def load_budget():
+    """Reads the mode -> milliseconds budget, one mode per line."""
+    budget = []
+    for line in open(BUDGET):
+        line = line.split("#")[0].strip()
+        if line:
+            ms, mode = line.split(None, 1)
+            budget.append((mode, float(ms)))
+    return budget
+
+def clear_caches():
+    for cache in CACHES:
+        if os.path.exists(cache): os.unlink(cache)
+
+def run(mode):
+    """Runs bin/vellum in mode once, returning the milliseconds it took."""
+    start = time.time()
+    devnull = open(os.devnull, "w")
+    subprocess.call([sys.executable, "bin/vellum"] + mode.split(),
+                    stdout=devnull, stderr=devnull)
+    return (time.time() - start) * 1000
+
+def main(*args):
+    imports = "-i" in args
+    runs = int(([a for a in args if a != "-i"] or [5])[0])
+    over = []
+
+    print "%-22s %9s %9s %9s" % ("mode", "cold", "warm", "budget")
+    for mode, budget in load_budget():
+        clear_caches()
+        cold = run(mode)
+        warm = min([run(mode) for i in range(runs)])
+        flag = "" if warm <= budget else "  OVER"
+        if flag: over.append(mode)
+        print "%-22s %7.1fms %7.1fms %7.1fms%s" % (mode, cold, warm, budget, flag)
+
+        if imports:
+            subprocess.call([sys.executable, "-c", IMPORT_TIMER] + mode.split(),
+                            stdout=open(os.devnull, "w"))
+
+    if over:
+        print "Over budget: %s" % ", ".join(over)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
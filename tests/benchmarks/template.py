@@ -0,0 +1,54 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+"""
+Times Scribe.interpolate on the lines of a forall's do block for
+many files, once the way it used to work (expr % options, with the
+error name formatted up front) and once with compiled Templates.
+
+Usage: python tests/benchmarks/template.py [files]
+"""
+
+from vellum.scribe import Scribe
+from vellum.script import Script
+import sys
+import time
+
+LINES = ["gcc -c %(cflags)s %(file)s -o %(file)s.o",
+         "echo checked %(file)s",
+         "rm -f core"]
+
+class PercentScribe(Scribe):
+    """A Scribe that interpolates the way it used to."""
+
+    def interpolate(self, cmd_name, expr):
+        err_name = "%s %r" % (cmd_name, expr)
+        try:
+            return expr % self.options
+        except KeyError, err:
+            self.die(err_name, "No key %s for format, available keys are: %r" % (err, sorted(self.options.keys())))
+
+def run(scribe, files):
+    names = ["src/f%d.c" % i for i in xrange(files)]
+    start = time.time()
+    for name in names:
+        scribe.push_scope({"file": name})
+        for line in LINES:
+            scribe.interpolate("sh", line)
+        scribe.pop_scope()
+    return (time.time() - start) * 1000
+
+def main(files=20000):
+    files = int(files)
+    script = Script("build")
+    for i in range(300):
+        script.options["opt%d" % i] = i
+    script.options["cflags"] = "-O2 -Wall"
+
+    percent = run(PercentScribe(script), files)
+    compiled = run(Scribe(script), files)
+    print "%d files, %d lines each:" % (files, len(LINES))
+    print "  expr %% options %8.1fms" % percent
+    print "  Template        %8.1fms  %4.1fx faster" % (compiled, percent / compiled)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
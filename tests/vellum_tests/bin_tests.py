@@ -2,6 +2,7 @@
 
 from nose.tools import *
 from vellum.bin import *
+from vellum.script import Script
 import os
 
 def options_and_script(argv, needs_option):
@@ -22,6 +23,13 @@ def test_parse_sys_argv():
         ["-I"], ["--install"],
         ["-S"], ["--search"],
         ["-w", "build.vel"], ["--watch", "build.vel"],
+        ["-j", "2"], ["--jobs", "2"],
+        ["-c"], ["--cache"],
+        ["-P"], ["--persistent"],
+        ["-x"], ["--direct"],
+        ["-a"], ["--async"],
+        ["-B"], ["--daemon"],
+        ["-R", "http://127.0.0.1:8765/"], ["--remote-cache", "http://127.0.0.1:8765/"],
     ]
     assert all([parse_sys_argv(case) for case in cases])
 
@@ -77,6 +85,7 @@ def test_run():
             ["-F", "-d"], ["--dry-run", "--force"],
             ["-D"], ["--dump"],
             ["-I"], ["--install"],
+            ["-j", "2", "-d"], ["--jobs", "2", "--dry-run"],
             ]
     for case in cases:
         print "Testing %r" % case
@@ -0,0 +1,141 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.cache import Cache, RemoteCache
+from vellum.cacheserver import CacheServer
+from StringIO import StringIO
+import os
+import shutil
+import tarfile
+import threading
+
+def setup():
+    global cache
+    for root in ["/tmp/vellum_cache", "/tmp/vellum_cache_server",
+                 "/tmp/vellum_cache_local", "/tmp/vellum_cache_counted"]:
+        if os.path.exists(root):
+            shutil.rmtree(root)
+    cache = Cache("/tmp/vellum_cache", max_size=1)
+
+def test_key():
+    assert_equal(cache.key("a", [1, 2]), cache.key("a", [1, 2]))
+    assert_not_equal(cache.key("a", [1, 2]), cache.key("a", [2, 1]))
+
+def test_store_fetch():
+    open("/tmp/vellum_cached.txt", "w").write("cached")
+    key = cache.key("test_store_fetch")
+    assert not cache.fetch(key, ["/tmp/vellum_cached.txt"])
+
+    cache.store(key, ["/tmp/vellum_cached.txt"])
+    os.unlink("/tmp/vellum_cached.txt")
+    assert cache.fetch(key, ["/tmp/vellum_cached.txt"])
+    assert_equal(open("/tmp/vellum_cached.txt").read(), "cached")
+
+def test_fetch_globs():
+    os.makedirs("/tmp/vellum_cached_glob")
+    for name in ["a.o", "b.o"]:
+        open("/tmp/vellum_cached_glob/" + name, "w").write(name)
+    key = cache.key("test_fetch_globs")
+    cache.store(key, ["/tmp/vellum_cached_glob/a.o", "/tmp/vellum_cached_glob/b.o"])
+    shutil.rmtree("/tmp/vellum_cached_glob")
+
+    # an entry with none of the outputs in it is a miss
+    assert not cache.fetch(key, ["/tmp/vellum_cached_glob/*.c"])
+    assert cache.fetch(key, ["/tmp/vellum_cached_glob/*.o"])
+    assert_equal(sorted(os.listdir("/tmp/vellum_cached_glob")), ["a.o", "b.o"])
+    shutil.rmtree("/tmp/vellum_cached_glob")
+
+def test_hostile_entry():
+    # an entry from a shared cache only gets to restore the outputs
+    data = StringIO()
+    tar = tarfile.open(mode="w", fileobj=data)
+    def add(name, text="owned", type=tarfile.REGTYPE, link=""):
+        info = tarfile.TarInfo(name)
+        info.type, info.linkname, info.size = type, link, len(text)
+        tar.addfile(info, StringIO(text))
+    add("abs/tmp/vellum_hostile/out.txt", "fine")
+    add("abs/tmp/vellum_hostile_other.txt")
+    add("abs/tmp/vellum_hostile/../vellum_hostile_dots.txt")
+    add("rel/../vellum_hostile_rel.txt")
+    add("/abs/tmp/vellum_hostile/out.txt")
+    add("abs/tmp/vellum_hostile/link", "", tarfile.SYMTYPE, "/etc")
+    tar.close()
+
+    if os.path.exists("/tmp/vellum_hostile"): shutil.rmtree("/tmp/vellum_hostile")
+    key = cache.key("test_hostile_entry")
+    cache.put(key, data.getvalue())
+    assert cache.fetch(key, ["/tmp/vellum_hostile/out.txt", "/tmp/vellum_hostile/link"])
+    assert_equal(open("/tmp/vellum_hostile/out.txt").read(), "fine")
+    assert not os.path.lexists("/tmp/vellum_hostile/link")
+    for name in ["/tmp/vellum_hostile_other.txt", "/tmp/vellum_hostile_dots.txt",
+                 os.path.join(os.path.dirname(os.getcwd()), "vellum_hostile_rel.txt")]:
+        assert not os.path.exists(name), name
+    shutil.rmtree("/tmp/vellum_hostile")
+
+def test_evict():
+    big = "x" * (600 * 1024)
+    cache.put(cache.key("old"), big)
+    os.utime(cache.path(cache.key("old")), (0, 0))
+    cache.put(cache.key("new"), big)
+    assert not cache.get(cache.key("old"))
+    assert cache.get(cache.key("new"))
+    assert_equal(cache.size, cache.total())
+
+def test_evict_counts():
+    # stores only walk the cache again once they've gone over
+    walks = []
+    counted = Cache("/tmp/vellum_cache_counted", max_size=1)
+    entries = counted.entries
+    counted.entries = lambda: walks.append(1) or entries()
+    small = "x" * (100 * 1024)
+    for i in range(10):
+        counted.put(counted.key("small", i), small)
+    assert_equal(len(walks), 1)
+    counted.put(counted.key("small", 10), small)
+    assert_equal(len(walks), 2)
+    assert counted.size <= counted.max_size
+    assert_equal(counted.size, counted.total())
+
+def test_remote():
+    server = CacheServer(("127.0.0.1", 0), Cache("/tmp/vellum_cache_server"))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    remote = RemoteCache("http://127.0.0.1:%d/" % server.server_port)
+    key = cache.key("test_remote")
+    assert not remote.get(key)
+    assert remote.put(key, "remote data")
+    assert_equal(remote.get(key), "remote data")
+    assert not remote.put("../../etc/passwd", "bad key")
+
+    # a local miss falls through to the remote and then stays local
+    local = Cache("/tmp/vellum_cache_local", remote=remote)
+    assert_equal(local.get(key), "remote data")
+    assert os.path.exists(local.path(key))
+
+    local.put(cache.key("uploaded"), "up")
+    assert_equal(remote.get(cache.key("uploaded")), "up")
+    server.shutdown()
+
+def test_concurrent_puts():
+    # like the threaded cache server getting the same entry at once
+    shared = Cache("/tmp/vellum_cache_counted", max_size=1)
+    key = shared.key("test_concurrent_puts")
+    errors = []
+    def put():
+        try:
+            shared.put(key, "x" * 1024)
+        except Exception, err:
+            errors.append(err)
+    threads = [threading.Thread(target=put) for i in range(8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert_equal(errors, [])
+    assert_equal(shared.get(key), "x" * 1024)
+    assert_equal(shared.size, shared.total())
+
+def test_remote_down():
+    remote = RemoteCache("http://127.0.0.1:1/")
+    assert not remote.get(cache.key("nothing"))
+    assert not remote.put(cache.key("nothing"), "data")
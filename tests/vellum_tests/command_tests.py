@@ -76,6 +76,62 @@ def test_forall():
     assert not scribe.option("file")
     assert len(scribe.stack) == 0, "scribe stack should be empty"
 
+def test_forall_stream():
+    scribe.options["seen"] = []
+    scribe.command("forall", {
+        "files": "./vellum/*.py",
+        "stream": 1,
+        "do": [Reference("py", "seen.append(file)")]})
+    assert "./vellum/commands.py" in scribe.options["seen"]
+    assert_equal(len(scribe.options["seen"]), len(scribe.files.files(".", "./vellum/*.py")))
+    del scribe.options["seen"]
+
+def test_forall_jobs():
+    # shell lines run on threads, so their output comes back here
+    out = "/tmp/vellum_forall_jobs.out"
+    if os.path.exists(out): os.unlink(out)
+    scribe.command("forall", {
+        "files": "./vellum/s*.py",
+        "jobs": 3,
+        "do": ["echo %(file)s >> " + out]})
+    assert_equal(sorted(open(out).read().split()), sorted(scribe.files.files(".", "./vellum/s*.py")))
+
+    # py runs in a process of its own per file
+    os.unlink(out)
+    scribe.command("forall", {
+        "files": "./vellum/s*.py",
+        "jobs": 3,
+        "do": [Reference("py", "import os; open('%s', 'a').write(str(os.getpid()) + chr(10))" % out)]})
+    pids = open(out).read().split()
+    assert_equal(len(set(pids)), len(scribe.files.files(".", "./vellum/s*.py")))
+    assert str(os.getpid()) not in pids
+    os.unlink(out)
+
+    assert_raises(vellum.DieError, scribe.command, "forall", {
+        "files": "./vellum/s*.py",
+        "jobs": 2,
+        "do": ["test %(file)s != ./vellum/script.py"]})
+
+def test_forall_changed():
+    out = "/tmp/vellum_forall_changed.out"
+    if os.path.exists(out): os.unlink(out)
+    force = scribe.options.get("force")
+    scribe.options["force"] = False
+    forall = {"files": "./vellum/s*.py", "changed": 1, "digest": 1,
+              "do": ["echo %(file)s >> " + out]}
+    scribe.command("forall", forall)
+    first = open(out).read().split()
+    assert_equal(sorted(first), sorted(scribe.files.files(".", "./vellum/s*.py")))
+
+    scribe.command("forall", forall)
+    assert_equal(open(out).read().split(), first)
+
+    forall["jobs"] = 2
+    scribe.command("forall", forall)
+    assert_equal(open(out).read().split(), first)
+    os.unlink(out)
+    scribe.options["force"] = force
+
 def test_cd():
     assert scribe.is_command("cd")
     curdir = os.path.abspath(os.curdir)
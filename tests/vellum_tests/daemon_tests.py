@@ -0,0 +1,76 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.bin import parse_sys_argv
+from vellum.daemon import Daemon, forward
+from cStringIO import StringIO
+import os
+import threading
+import time
+
+SOCKET = "/tmp/vellum_daemon_test.sock"
+RECIPE = """options(default 'works')
+depends()
+targets(
+    works $ echo %s
+    fails $ false
+    env $ echo CC=$VELLUM_TEST_CC
+)
+"""
+
+def start(requests):
+    if os.path.exists(SOCKET): os.unlink(SOCKET)
+    open("/tmp/vellum_daemon_test.vel", "w").write(RECIPE % "works")
+    options, args = parse_sys_argv(["-f", "/tmp/vellum_daemon_test"])
+    daemon = Daemon(options, SOCKET)
+    thread = threading.Thread(target=daemon.serve, args=(requests,))
+    thread.setDaemon(True)
+    thread.start()
+    while not os.path.exists(SOCKET):
+        time.sleep(0.01)
+    return thread
+
+def run(argv):
+    out = StringIO()
+    status = forward(SOCKET, ["-f", "/tmp/vellum_daemon_test"] + argv, out)
+    return status, out.getvalue()
+
+def test_forward():
+    thread = start(6)
+
+    status, out = run(["works"])
+    assert_equal(status, 0)
+    assert "-->: works" in out
+    assert "\nworks\n" in out
+
+    status, out = run(["fails"])
+    assert_equal(status, 1)
+    assert "ERROR" in out
+
+    # an edited recipe gets picked up by the running daemon
+    open("/tmp/vellum_daemon_test.vel", "w").write(RECIPE % "changed")
+    status, out = run(["works"])
+    assert "\nchanged\n" in out
+
+    status, out = run(["-T"])
+    assert "DEFAULT: works" in out
+
+    # the build sees the client's environment, not the daemon's
+    os.environ["VELLUM_TEST_CC"] = "clang"
+    try:
+        status, out = run(["env"])
+    finally:
+        del os.environ["VELLUM_TEST_CC"]
+    assert "\nCC=clang\n" in out
+
+    # and one from another directory is left to the client
+    here = os.getcwd()
+    os.chdir("/tmp")
+    try:
+        assert_equal(run(["works"]), (None, ""))
+    finally:
+        os.chdir(here)
+
+    thread.join()
+    assert not os.path.exists(SOCKET)
+    assert_equal(forward(SOCKET, ["-T"]), None)
@@ -0,0 +1,89 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.engine import Engine, Wait
+from vellum.ledger import Ledger
+from vellum.scribe import Scribe
+from vellum.script import Script
+import vellum
+import time
+
+def setup():
+    global scribe
+    scribe = Scribe(Script("build"))
+
+def steps(*cmds):
+    return (cmd for cmd in cmds)
+
+def test_run():
+    engine = Engine()
+    results = []
+    engine.add(scribe, steps("echo one", "echo two"), results.append)
+    engine.add(scribe, steps(), results.append)
+    engine.run()
+    assert_equal(results, [None, None])
+
+def test_concurrent():
+    engine = Engine()
+    results = []
+    for i in range(4):
+        engine.add(scribe, steps("sleep 0.3"), results.append)
+    start = time.time()
+    engine.run()
+    assert time.time() - start < 1.0, "sleeps should overlap"
+    assert_equal(results, [None] * 4)
+
+def test_jobs():
+    engine = Engine(jobs=1)
+    results = []
+    for i in range(3):
+        engine.add(scribe, steps("sleep 0.1"), results.append)
+    start = time.time()
+    engine.run()
+    assert time.time() - start >= 0.3, "jobs=1 should run them one at a time"
+
+def test_failure():
+    engine = Engine()
+    results = []
+    engine.add(scribe, steps("false", "echo never"), results.append)
+    engine.run()
+    assert isinstance(results[0], vellum.DieError)
+
+def test_cancel():
+    engine = Engine()
+    results = []
+    def fail(err):
+        results.append(err)
+        engine.cancel()
+    engine.add(scribe, steps("sleep 5"), results.append)
+    engine.add(scribe, steps("false"), fail)
+    start = time.time()
+    engine.run()
+    assert time.time() - start < 2.0, "cancel should kill the sleep"
+
+def test_wait():
+    ledger = Ledger()
+    ledger.claim("slow", "other")
+    engine = Engine()
+    results = []
+    waits = [Wait(ledger, "slow", "me")]
+    def finish():
+        yield "sleep 0.2"
+        ledger.finish("slow")
+    def waiter():
+        yield waits[0]
+        results.append("ran")
+    engine.add(scribe, waiter(), results.append)
+    engine.add(scribe, finish(), results.append)
+    engine.run()
+    assert_equal(results, [None, "ran", None])
+
+def test_wait_forever():
+    # jobs left waiting on what nothing is running fail
+    ledger = Ledger()
+    ledger.claim("stuck", "other")
+    engine = Engine()
+    results = []
+    engine.add(scribe, (w for w in [Wait(ledger, "stuck", "me")]), results.append)
+    engine.run()
+    assert isinstance(results[0], vellum.DieError)
@@ -0,0 +1,78 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.index import FileIndex, IGNORE, Matches, walk, start
+from vellum.stats import StatCache
+from vellum.store import Store
+import fnmatch
+import os
+import shutil
+import time
+
+ROOT = "/tmp/vellum_index"
+
+def setup():
+    if os.path.exists(ROOT): shutil.rmtree(ROOT)
+    for dir in ["src/app", "src/lib", ".git/objects", "build", "pkg.egg-info"]:
+        os.makedirs(os.path.join(ROOT, dir))
+    for name in ["setup.py", "README", "src/app/main.py", "src/lib/util.py",
+                 "src/lib/util.c", ".git/objects/a.py", "build/gen.py",
+                 "pkg.egg-info/x.py"]:
+        open(os.path.join(ROOT, name), "w").write(name)
+    old = time.time() - 10
+    for path, dirs, files in os.walk(ROOT):
+        os.utime(path, (old, old))
+
+def index():
+    return FileIndex(StatCache(), Store("files", ROOT + "/.vellum"))
+
+def walked(top, pattern, ignore=[]):
+    matches = []
+    for path, dirs, fnames in os.walk(top):
+        dirs[:] = [d for d in dirs if not [p for p in ignore if fnmatch.fnmatch(d, p)]]
+        matches.extend(fnmatch.filter([os.path.join(path, f) for f in fnames], pattern))
+    return matches
+
+def test_files():
+    files = index()
+    for pattern in ["*.py", ROOT + "/src/*.py", ROOT + "/src/lib/*",
+                    ROOT + "/*/lib/*.c", ROOT + "/README", "*.h"]:
+        assert_equal(files.files(ROOT, pattern), walked(ROOT, pattern, IGNORE))
+
+    assert ROOT + "/build/gen.py" not in files.files(ROOT, "*.py")
+    assert_equal(files.files(ROOT, "*.py", IGNORE + ["app"]), [ROOT + "/setup.py", ROOT + "/src/lib/util.py"])
+
+    # naming an ignored directory in the pattern still searches it
+    assert_equal(files.files(ROOT, ROOT + "/build/*.py"), [ROOT + "/build/gen.py"])
+
+def test_walk():
+    for pattern in ["*.py", ROOT + "/src/*.py", "*/README"]:
+        assert_equal(list(walk(ROOT, pattern)), walked(ROOT, pattern, IGNORE))
+
+    matches = Matches(ROOT, "*.py")
+    assert_equal(len(matches), 3)
+    assert ROOT + "/setup.py" in matches
+    assert_equal(str(matches), str(walked(ROOT, "*.py", IGNORE)))
+    assert_equal("%(files)s" % {"files": matches}, str(matches))
+
+def test_start():
+    assert_equal(start(".", "*.py"), ".")
+    assert_equal(start(".", "./src/lib/*.py"), "./src/lib")
+    assert_equal(start(".", "./src/*/x.py"), "./src")
+    assert_equal(start(".", "./src/../x.py"), "./src")
+    assert_equal(start("src", "./src/x.py"), "src")
+
+def test_persist():
+    files = index()
+    files.files(ROOT, "*.py")
+    files.save()
+
+    again = index()
+    assert again.store.get(ROOT + "/src/lib")
+    assert_equal(again.files(ROOT, "*.py"), files.files(ROOT, "*.py"))
+
+    # a new file changes its directory's mtime so it's listed again
+    open(ROOT + "/src/lib/more.py", "w").write("more")
+    again.stats.clear()
+    assert ROOT + "/src/lib/more.py" in again.files(ROOT, "*.py")
+    os.unlink(ROOT + "/src/lib/more.py")
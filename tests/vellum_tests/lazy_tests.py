@@ -0,0 +1,32 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.lazy import Command, find_source, index_source
+import vellum.commands
+import sys
+
+def test_find_source():
+    assert find_source("vellum.commands", sys.path).endswith("vellum/commands.py")
+    assert find_source("vellum", sys.path).endswith("vellum/__init__.py")
+    assert_equal(find_source("vellum.not_there", sys.path), None)
+    assert_equal(find_source("sys", sys.path), None)
+
+def test_index_source():
+    index = index_source(find_source("vellum.commands", sys.path))
+    assert "sh" in index
+    assert "os" not in index
+    assert_equal(index["forall"], (None, "forall", vellum.commands.forall.__doc__))
+    # re-exported commands resolve through the module that defines them
+    assert_equal(index["Changes"][:2], ("vellum.manifest", "Changes"))
+    assert "IGNORE" not in index
+
+def test_command():
+    open("/tmp/vellum_lazy_test.py", "w").write(
+        "def hello(scribe, expr):\n    return expr\n")
+    path = list(sys.path)
+    cmd = Command("vellum_lazy_test", "hello", "Says hello.", "/tmp")
+    assert_equal(cmd.__doc__, "Says hello.")
+    assert "vellum_lazy_test" not in sys.modules
+    assert_equal(cmd(None, "hi"), "hi")
+    assert "vellum_lazy_test" in sys.modules
+    assert_equal(sys.path, path)
@@ -0,0 +1,56 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.ledger import Ledger
+import threading
+import time
+
+def test_claim_finish():
+    ledger = Ledger()
+    assert ledger.claim("a")
+    assert not ledger.claim("a"), "the same thread shouldn't run it twice"
+    ledger.finish("a")
+    assert "a" in ledger
+    assert not ledger.claim("a")
+
+    assert ledger.claim("b")
+    ledger.finish("b", done=False)
+    assert "b" not in ledger
+    assert ledger.claim("b")
+
+def test_begin():
+    ledger = Ledger()
+    for key, prints in [("none", ()), ("same", (1,)), ("changed", (2,))]:
+        ledger.claim(key)
+        ledger.finish(key, prints)
+
+    ledger.begin(lambda key: {"same": (1,), "changed": (3,)}.get(key))
+    assert "same" in ledger
+    assert "changed" not in ledger
+    assert "none" not in ledger
+
+def test_wait():
+    ledger = Ledger()
+    ran = []
+    def worker():
+        if ledger.claim("slow"):
+            time.sleep(0.1)
+            ran.append(1)
+            ledger.finish("slow")
+
+    threads = [threading.Thread(target=worker) for i in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert_equal(ran, [1])
+
+def test_owners():
+    # two owners on the same thread, like jobs in the async engine
+    ledger = Ledger()
+    one, two = object(), object()
+    assert ledger.claim("a", one)
+    assert not ledger.claim("a", one)
+    assert ledger.busy("a", two)
+    assert not ledger.busy("a", one)
+    ledger.finish("a")
+    assert not ledger.busy("a", two)
+    assert not ledger.claim("a", two)
@@ -0,0 +1,75 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.manifest import Manifest, Changes
+from vellum.stats import StatCache
+from vellum.store import Store
+import os
+import shutil
+import time
+
+ROOT = "/tmp/vellum_manifest"
+
+def setup():
+    if os.path.exists(ROOT): shutil.rmtree(ROOT)
+    os.makedirs(ROOT)
+    for name in ["aa", "bb", "cc"]:
+        open(os.path.join(ROOT, name), "w").write(name)
+
+def manifest():
+    return Manifest(StatCache(), Store("manifests", ROOT + "/.vellum"))
+
+def run(changes, fail=[]):
+    ran = []
+    for file in changes:
+        ran.append(os.path.basename(file))
+        changes.done(file, os.path.basename(file) not in fail)
+    changes.record()
+    return ran
+
+def test_fingerprint():
+    files = manifest()
+    old = files.fingerprint(ROOT + "/aa")
+    assert_equal(old[2], None)
+    assert files.fingerprint(ROOT + "/aa", True, old) is old
+    assert_equal(files.fingerprint(ROOT + "/missing"), None)
+
+    new = files.fingerprint(ROOT + "/aa", True)
+    later = (new[0] + 1, new[1], new[2])
+    assert files.unchanged(new, later)  # touched, same contents
+    assert not files.unchanged(old, (old[0] + 1, old[1], None))
+    assert not files.unchanged(None, new)
+
+def test_changes():
+    files = manifest()
+    paths = [os.path.join(ROOT, n) for n in ["aa", "bb", "cc"]]
+    key = ("lint", ".", "*", "file")
+
+    assert_equal(run(Changes(files, key, ["body"], paths), fail=["bb"]), ["aa", "bb", "cc"])
+    assert_equal(run(Changes(files, key, ["body"], paths)), ["bb"])
+    assert_equal(run(Changes(files, key, ["body"], paths)), [])
+
+    # a changed file runs again, and so does everything after -F
+    # or after the do block changes
+    time.sleep(0.01)
+    open(ROOT + "/cc", "w").write("changed")
+    files.stats.clear()
+    assert_equal(run(Changes(files, key, ["body"], paths)), ["cc"])
+    assert_equal(run(Changes(files, key, ["body"], paths, force=True)), ["aa", "bb", "cc"])
+    assert_equal(run(Changes(files, key, ["other"], paths)), ["aa", "bb", "cc"])
+
+    # and so does everything after an option the block uses changes
+    body = ["lint %(flags)s %(file)s"]
+    run(Changes(files, key, body, paths, options={"flags": "-a", "other": 1}))
+    assert_equal(run(Changes(files, key, body, paths, options={"flags": "-a", "other": 2})), [])
+    assert_equal(run(Changes(files, key, body, paths, options={"flags": "-b"})), ["aa", "bb", "cc"])
+    run(Changes(files, key, ["other"], paths))
+
+    # what's recorded survives a save
+    files.save()
+    again = manifest()
+    assert_equal(run(Changes(again, key, ["other"], paths)), [])
+
+    # gone files are dropped
+    run(Changes(again, key, ["other"], paths[:1]))
+    assert_equal(sorted(again.load(key, ["other"])), paths[:1])
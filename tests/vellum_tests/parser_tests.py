@@ -1,11 +1,14 @@
 # Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
 
 import vellum.parser
+from vellum.scanner import TokenScanner, unquote, stanzas
 from nose.tools import *
+import cPickle as pickle
+import glob
 
 def parse(what, s):
     """This adds the \0 terminator for the parser."""
-    return vellum.parser.parse(what, s + "\0")
+    return vellum.parser.parse_tokens(what, s + "\0")
 
 def parse_file(file):
     f = open(file,'r')
@@ -59,3 +62,41 @@ def test_parse_reference():
 
 
 
+
+def test_unquote():
+    for case in ["'plain'", '"double"', "'it\\'s'", '"tab\\there\\n"', "'%(file)s'"]:
+        assert_equal(unquote(case), eval(case))
+
+def test_token_scanner():
+    # the single pass scanner has to give what the generated one does
+    for file in ["build.vel"] + glob.glob("scripts/*.vel"):
+        text = open(file).read() + "\0"
+        old = vellum.parser.Parser(vellum.parser.ParserScanner(text)).input()
+        new = vellum.parser.Parser(TokenScanner(text)).input()
+        assert_equal(repr(old), repr(new), "%s parsed differently" % file)
+        assert_equal(repr(vellum.parser.parse("input", text)),
+                     repr(vellum.parser.parse_tokens("input", text)))
+
+def test_token_scanner_lines():
+    scanner = TokenScanner("# comment\nname $ echo hi\n\0")
+    kinds = [tok[2] for tok in scanner.tokens]
+    assert_equal(kinds, ["COMMENT", "LINE", "NAME", "SH", "LINE", "ENDMARKER"])
+    assert_equal(scanner.tokens[4][3], " echo hi\n")
+
+def test_reference_slots():
+    ref = vellum.parser.Reference("sh", "echo test")
+    assert_raises(AttributeError, setattr, ref, "other", 1)
+    ref = pickle.loads(pickle.dumps(ref))
+    assert_equal((ref.name, ref.expr), ("sh", "echo test"))
+    assert ref.name is intern("sh")
+
+def test_stanzas():
+    text = "# comment\noptions(default 'aa')\ntargets(aa $ echo a\n bb [$ echo b\n])\n\0"
+    found = stanzas(text)
+    assert_equal(sorted(found.keys()), ["options", "targets"])
+    span, entries = found["targets"]
+    assert_equal(text[slice(*span)], "targets(aa $ echo a\n bb [$ echo b\n])")
+    assert_equal(text[slice(*entries["aa"])], "aa $ echo a\n")
+    assert_equal(text[slice(*entries["bb"])], "bb [$ echo b\n]")
+    assert_equal(stanzas("imports[recipe(from 'x')]\0")["imports"][1], None)
+    assert_equal(stanzas("targets(aa [\0"), None)
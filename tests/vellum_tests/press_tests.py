@@ -1,12 +1,21 @@
 # Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
 
-from vellum.press import Press
+from vellum.press import Press, compact
+from vellum.lazy import Command, index_source
 from nose.tools import *
+from StringIO import StringIO
+import vellum.parser
+import vellum.commands
+import os
 import sys
+import threading
+import time
 
 def assert_valid(spec):
     tests = [("default","options"),
             ("build","depends"),
+            ("parser","inputs"),
+            ("parser","outputs"),
             ("sample.commands","targets")]
     for sub,key in tests:
         assert spec[key]
@@ -86,3 +95,131 @@ def test_join():
     for i in ["cleanfucker", "vellum.test", "things"]:
         assert "%s.test" % i in target["targets"]
     
+
+def test_parse_cache():
+    press = Press("build")
+    assert os.path.abspath("build.vel") in press.parsed
+    spec = press.parse_recipe("build.vel")
+    assert_equal(sorted(spec.keys()),
+                 sorted(vellum.parser.parse_tokens('input', open("build.vel").read() + '\0').keys()))
+
+    open("/tmp/vellum_parse_cache.vel", "w").write("targets(first 'one')")
+    assert "first" in press.parse_recipe("/tmp/vellum_parse_cache.vel")["targets"]
+    open("/tmp/vellum_parse_cache.vel", "w").write("targets(second 'two')")
+    os.utime("/tmp/vellum_parse_cache.vel", (time.time() + 10, time.time() + 10))
+    assert "second" in press.parse_recipe("/tmp/vellum_parse_cache.vel")["targets"]
+
+def test_compact():
+    spec = vellum.parser.parse_tokens('input', """
+        options(paths ['a' 'b'])
+        depends(one ['two'])
+        targets(one [
+            $ echo one
+            mkdirs ['x']
+        ]
+        two [
+            $ echo one
+        ])\0""")
+    compact(spec)
+    one, two = spec["targets"]["one"], spec["targets"]["two"]
+    assert isinstance(one, tuple)
+    assert_equal(one[0].strip(), "echo one")
+    assert_equal(one[1].expr, ("x",))
+    assert one[0] is two[0], "command lines should be interned"
+    assert_equal(spec["depends"]["one"], ("two",))
+    assert_equal(spec["options"]["paths"], ["a", "b"])
+
+def test_refresh():
+    recipe = "options(default 'same')\ntargets(\n same $ echo same\n changed $ echo %s\n)\n"
+    open("/tmp/vellum_refresh.vel", "w").write(recipe % "one")
+    press = Press("/tmp/vellum_refresh")
+    same = press.main["targets"]["same"]
+    assert_equal(press.refresh(), [])
+
+    open("/tmp/vellum_refresh.vel", "w").write(recipe % "two")
+    assert_equal(press.refresh(), [("targets", "changed")])
+    assert_equal(press.main["targets"]["changed"].strip(), "echo two")
+    assert press.main["targets"]["same"] is same
+
+    open("/tmp/vellum_refresh.vel", "w").write(recipe % "two" + "imports[]\n")
+    assert_equal(press.refresh(), None)
+
+def test_prefetch():
+    press = Press("build")
+    assert_equal(press.prefetched, {})
+    threads = threading.activeCount()
+    press.prefetch(press.main)
+    assert_equal(threading.activeCount(), threads)  # the workers are joined
+    imported = set(press.sources) - set(["build.vel"])
+    assert_equal(set(press.prefetched), imported)
+    for file in imported:
+        assert_equal(repr(press.load_recipe(file)), repr(press.parse_recipe(file)))
+    assert_equal(press.prefetched, {})
+
+def test_prefetch_quiet():
+    # a broken recipe's error is only printed when load() parses it
+    open("/tmp/vellum_broken.vel", "w").write("targets(oops\n")
+    press = Press("build")
+    stderr, stdout = sys.stderr, sys.stdout
+    sys.stderr = sys.stdout = StringIO()
+    try:
+        assert_equal(press.prefetch_recipe("/tmp/vellum_broken.vel"),
+                     ("/tmp/vellum_broken.vel", None))
+        printed = sys.stderr.getvalue()
+    finally:
+        sys.stderr, sys.stdout = stderr, stdout
+    assert_equal(printed, "")
+
+def test_lazy_commands():
+    press = Press("build")
+    sh = press.main["commands"]["sh"]
+    assert isinstance(sh, Command)
+    assert_equal(sh.__doc__, vellum.commands.sh.__doc__)
+    assert sh.resolve() is vellum.commands.sh
+    assert "vellum.commands" in press.indexed
+
+def test_index_agrees():
+    # the lazy index and a real import find the same commands
+    open("/tmp/vellum_agree_other.py", "w").write(
+        "def cmd(scribe, expr):\n    'Does a thing.'\n")
+    open("/tmp/vellum_agree_test.py", "w").write(
+        "from vellum.manifest import Changes\n"
+        "from vellum_agree_other import cmd as other\n"
+        "from vellum import commands\n"
+        "import os\n"
+        "WORDS = ['a']\n"
+        "def hello(scribe, expr):\n    'Says hello.'\n"
+        "def _private(scribe, expr): pass\n"
+        "class Thing(object): pass\n"
+        "hi = hello\n"
+        "public = _private\n"
+        "shout = lambda scribe, expr: expr\n"
+        "words = WORDS\n"
+        "if __name__ == '__main__': hello(None, None)\n")
+    open("/tmp/vellum_agree_unsure.py", "w").write(
+        "import os\n"
+        "path = os.path.join\n")
+    press = Press("build")
+    source, press.module_source = press.module_source, "/tmp"
+    try:
+        imported = press.import_module("vellum_agree_test")
+        assert_equal(sorted(imported),
+                     sorted(["Changes", "other", "hello", "Thing", "hi", "public", "shout"]))
+        index = index_source("/tmp/vellum_agree_test.py", sys.path + ["/tmp"])
+        assert_equal(sorted(index), sorted(imported))
+        assert_equal(index["other"], ("vellum_agree_other", "cmd", "Does a thing."))
+
+        lazy = press.load_module("vellum_agree_test")
+        assert_equal(sorted(lazy), sorted(imported))
+        for name in lazy:
+            assert lazy[name].resolve() is imported[name], name
+
+        # it can't tell what os.path.join is, so it imports the module
+        assert_equal(index_source("/tmp/vellum_agree_unsure.py"), None)
+        assert_equal(press.load_module("vellum_agree_unsure").keys(), ["path"])
+    finally:
+        press.module_source = source
+
+    source = vellum.commands.__file__.replace(".pyc", ".py")
+    assert_equal(sorted(index_source(source)),
+                 sorted(press.import_module("vellum.commands")))
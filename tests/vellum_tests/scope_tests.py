@@ -0,0 +1,45 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.scope import Scope
+
+def test_layers():
+    base = {"aa": 1, "bb": 2}
+    scope = Scope({"bb": 3, "cc": 4}, base)
+    inner = Scope({"dd": 5}, scope)
+
+    assert_equal(inner["aa"], 1)
+    assert_equal(inner["bb"], 3)
+    assert_equal(inner.get("zz", "none"), "none")
+    assert "dd" in inner and "dd" not in scope
+    assert_raises(KeyError, lambda: inner["zz"])
+
+    inner["aa"] = 10
+    del inner["cc"]
+    assert_equal(inner["aa"], 10)
+    assert "cc" not in inner
+    assert_equal(scope["cc"], 4)
+    assert_equal(base, {"aa": 1, "bb": 2})
+    assert_raises(KeyError, inner.__delitem__, "cc")
+
+def test_dict():
+    scope = Scope({"bb": 3}, {"aa": 1})
+    flat = scope.copy()
+    assert_equal(type(flat), dict)
+    assert_equal(flat, {"aa": 1, "bb": 3})
+    assert scope == {"aa": 1, "bb": 3}
+    assert {"aa": 1, "bb": 3} == scope
+    assert scope != {"aa": 1}
+    assert_equal(sorted(scope.keys()), ["aa", "bb"])
+    assert_equal(len(scope), 2)
+    assert_equal(sorted(scope.items()), [("aa", 1), ("bb", 3)])
+
+def test_namespaces():
+    scope = Scope({"name": "vellum"}, {"count": 2})
+    assert_equal("%(name)s %(count)d" % scope, "vellum 2")
+    assert_raises(KeyError, lambda: "%(missing)s" % scope)
+
+    exec "total = count * 2\nimport os" in {}, scope
+    assert_equal(scope.vars["total"], 4)
+    assert "os" in scope.vars
+    assert_equal(eval("name.upper()", {}, scope), "VELLUM")
@@ -5,7 +5,9 @@ from vellum.scribe import Scribe
 from vellum.script import Script
 import vellum
 from vellum.parser import Reference
+from vellum.cache import Cache
 import os
+import shutil
 
 def setup():
     global scribe
@@ -100,9 +102,295 @@ def test_push_pop_scope():
 
 def test_interpolate():
     assert scribe.interpolate("test", "%(setup)s") == repr(scribe.options["setup"])
+    scribe.options["keep_going"] = False
+    try:
+        scribe.interpolate("test", "%(setpu)s")
+        assert False, "should have died"
+    except vellum.DieError, err:
+        assert "did you mean setup?" in err.message
+
+def test_signature():
+    script = scribe.script
+    script.targets["test.signature"] = "echo %(sigopt)s"
+    script.options["sigopt"] = "one"
+    try:
+        first = scribe.signature("test.signature")
+        script.options["sigopt"] = "two"
+        assert first != scribe.signature("test.signature")
+    finally:
+        del script.targets["test.signature"]
+        del script.options["sigopt"]
 
 def test_transition():
     scribe.transition("testing.noop")
 
 def test_build():
     scribe.build(["testing.noop"])
+
+DIAMOND_LOG = "/tmp/vellum_diamond.log"
+
+def diamond(fail=None, slow="0.2"):
+    """
+    Makes test.a need test.b and test.c, which both need test.d,
+    with each logging when it starts and finishes.  test.c also
+    leads to test.e, so a failing test.b has something to stop.
+    """
+    script = scribe.script
+    for name in "abcde":
+        script.targets["test." + name] = [
+            "echo start %s >> %s" % (name, DIAMOND_LOG),
+            "sleep %s" % (slow if name in "bc" else "0.05"),
+            "false" if name == fail else "true",
+            "echo finish %s >> %s" % (name, DIAMOND_LOG)]
+    script.depends["test.a"] = ["test.b", "test.e"]
+    script.depends["test.b"] = ["test.d"]
+    script.depends["test.c"] = ["test.d"]
+    script.depends["test.e"] = ["test.c"]
+    script.graph.reset()
+    if os.path.exists(DIAMOND_LOG): os.unlink(DIAMOND_LOG)
+
+def diamond_log():
+    return [line.strip() for line in open(DIAMOND_LOG)]
+
+def diamond_cleanup():
+    script = scribe.script
+    for name in "abcde":
+        del script.targets["test." + name]
+        script.depends.pop("test." + name, None)
+    script.graph.reset()
+    if os.path.exists(DIAMOND_LOG): os.unlink(DIAMOND_LOG)
+
+def assert_diamond(log):
+    assert log.index("finish d") < log.index("start b")
+    assert log.index("finish d") < log.index("start c")
+    assert log.index("finish c") < log.index("start e")
+    for before in "bce":
+        assert log.index("finish " + before) < log.index("start a")
+    # b and c run at the same time
+    assert log.index("start c") < log.index("finish b")
+    assert log.index("start b") < log.index("finish c")
+
+def test_build_parallel():
+    scribe.options["jobs"] = 2
+    try:
+        scribe.build(["testing.noop"])
+
+        diamond()
+        scribe.build(["test.a"])
+        assert_diamond(diamond_log())
+
+        # test.b failing stops test.e from starting after test.c
+        diamond(fail="b", slow="0.05")
+        scribe.script.targets["test.c"][1] = "sleep 0.4"
+        assert_raises(vellum.DieError, scribe.build, ["test.a"])
+        log = diamond_log()
+        assert "finish c" in log
+        assert "start e" not in log
+        assert "start a" not in log
+
+        # a cd changes the directory for every thread, so it runs alone
+        script = scribe.script
+        script.targets["test.ta"] = [Reference("cd", {"to": "tests", "do": ["sleep 0.5"]})]
+        script.targets["test.tb"] = ["sleep 0.2", "pwd >> " + DIAMOND_LOG]
+        script.targets["test.tc"] = [Reference("needs", ["test.ta"])]
+        script.targets["test.tall"] = "true"
+        script.depends["test.tall"] = ["test.ta", "test.tb"]
+        script.graph.reset()
+        assert scribe.changes_dir("test.ta")
+        assert scribe.changes_dir("test.tc")
+        assert not scribe.changes_dir("test.tb")
+        os.unlink(DIAMOND_LOG)
+        scribe.build(["test.tall"])
+        assert_equal(diamond_log(), [os.getcwd()])
+    finally:
+        scribe.options["jobs"] = 1
+        diamond_cleanup()
+        for name in ["test.ta", "test.tb", "test.tc", "test.tall"]:
+            scribe.script.targets.pop(name, None)
+        scribe.script.depends.pop("test.tall", None)
+        scribe.script.graph.reset()
+
+def test_run_target():
+    assert_equal(scribe.run_target("testing.noop"), ("testing.noop", None))
+
+def test_up_to_date():
+    script = scribe.script
+    script.targets["test.uptodate"] = "touch /tmp/vellum_uptodate.out"
+    script.inputs["test.uptodate"] = ["scripts/*.vel"]
+    script.outputs["test.uptodate"] = ["/tmp/vellum_uptodate.out"]
+    if os.path.exists("/tmp/vellum_uptodate.out"):
+        os.unlink("/tmp/vellum_uptodate.out")
+
+    assert not scribe.up_to_date("test.uptodate")
+    scribe.transition("test.uptodate")
+    assert scribe.up_to_date("test.uptodate")
+
+    # changing the commands makes it stale again
+    script.targets["test.uptodate"] += " /tmp/vellum_uptodate.other"
+    assert not scribe.up_to_date("test.uptodate")
+    del script.targets["test.uptodate"]
+
+def test_cache_key():
+    assert not scribe.cache_key("parser")
+    scribe.options["cache"] = True
+    try:
+        key = scribe.cache_key("parser")
+        assert key
+        assert_equal(key, scribe.cache_key("parser"))
+    finally:
+        scribe.options["cache"] = False
+
+def test_run_once():
+    scribe.script.targets["test.once"] = "echo once >> /tmp/vellum_once.out"
+    scribe.script.targets["test.twice"] = [Reference("needs", ["test.once"])]
+    scribe.script.depends["test.twice"] = ["test.once"]
+    scribe.script.graph.reset()
+    if os.path.exists("/tmp/vellum_once.out"):
+        os.unlink("/tmp/vellum_once.out")
+
+    scribe.build(["test.twice"])
+    assert_equal(open("/tmp/vellum_once.out").read(), "once\n")
+    scribe.build(["test.twice"])
+    assert_equal(open("/tmp/vellum_once.out").read(), "once\nonce\n")
+
+    del scribe.script.targets["test.once"]
+    del scribe.script.targets["test.twice"]
+    del scribe.script.depends["test.twice"]
+    scribe.script.graph.reset()
+
+def test_build_twice():
+    # targets reached through a forall were fingerprinted with its
+    # %(file)s, so the next build mustn't fingerprint them without it
+    script = scribe.script
+    out = "/tmp/vellum_twice.out"
+    script.targets["test.each"] = [Reference("forall", {"files": "./vellum/s*.py",
+                                   "do": [Reference("needs", ["test.lint"])]})]
+    script.targets["test.lint"] = "echo %(file)s >> " + out
+    script.inputs["test.lint"] = ["%(file)s"]
+    script.targets["test.edited"] = "echo one >> " + out
+    script.inputs["test.edited"] = ["build.vel"]
+    script.graph.reset()
+    if os.path.exists(out): os.unlink(out)
+    try:
+        scribe.build(["test.each"])
+        scribe.build(["test.each"])
+        files = len(scribe.files.files(".", "./vellum/s*.py"))
+        assert_equal(len(open(out).read().split()), 2 * files)
+
+        # an edited body runs again even though its files haven't changed
+        os.unlink(out)
+        scribe.build(["test.edited"])
+        scribe.build(["test.edited"])
+        assert_equal(open(out).read(), "one\n")
+        script.targets["test.edited"] = "echo two >> " + out
+        scribe.build(["test.edited"])
+        assert_equal(open(out).read(), "one\ntwo\n")
+    finally:
+        for name in ["test.each", "test.lint", "test.edited"]:
+            del script.targets[name]
+        del script.inputs["test.lint"]
+        del script.inputs["test.edited"]
+        script.graph.reset()
+        if os.path.exists(out): os.unlink(out)
+
+def test_persistent():
+    scribe.script.targets["test.persistent"] = "cd /tmp\ntest `pwd` = /tmp"
+    scribe.options["persistent"] = True
+    try:
+        scribe.transition("test.persistent")
+        assert not scribe.shell, "transition should close the shell"
+    finally:
+        scribe.options["persistent"] = False
+        del scribe.script.targets["test.persistent"]
+
+def test_steps():
+    steps = list(scribe.steps(["echo one", Reference("log", "two"), "", "echo three"]))
+    assert_equal(steps, ["echo one", "echo three"])
+
+def test_cache_glob():
+    # outputs declared as a glob come back out of the cache
+    script = scribe.script
+    out = "/tmp/vellum_cache_glob"
+    script.targets["test.objs"] = ("mkdir -p %s/out && touch %s/out/a.o %s/out/b.o "
+                                   "&& echo built >> %s/log" % (out, out, out, out))
+    script.outputs["test.objs"] = [out + "/out/*.o"]
+    cache = scribe.cache
+    scribe.cache = Cache(out + "/cache")
+    scribe.options["cache"] = True
+    try:
+        scribe.build(["test.objs"])
+        shutil.rmtree(out + "/out")
+        scribe.build(["test.objs"])
+        assert_equal(sorted(os.listdir(out + "/out")), ["a.o", "b.o"])
+        assert_equal(open(out + "/log").read(), "built\n")
+    finally:
+        scribe.options["cache"] = False
+        scribe.cache = cache
+        del script.targets["test.objs"]
+        del script.outputs["test.objs"]
+        if "test.objs" in scribe.signatures: del scribe.signatures["test.objs"]
+        shutil.rmtree(out)
+
+def test_build_async():
+    scribe.options["async"] = True
+    jobs = scribe.options.get("jobs")
+    try:
+        scribe.build(["testing.noop"])
+
+        scribe.options["jobs"] = None
+        diamond()
+        scribe.build(["test.a"])
+        assert_diamond(diamond_log())
+
+        diamond(fail="b", slow="0.05")
+        scribe.script.targets["test.c"][1] = "sleep 0.4"
+        assert_raises(vellum.DieError, scribe.build, ["test.a"])
+        log = diamond_log()
+        assert "start e" not in log
+        assert "start a" not in log
+
+        # -j 1 runs one command at a time, so b and c don't overlap
+        scribe.options["jobs"] = 1
+        diamond()
+        scribe.build(["test.a"])
+        log = diamond_log()
+        assert (log.index("finish b") < log.index("start c") or
+                log.index("finish c") < log.index("start b"))
+
+        # a needs for a target another job is running waits for it
+        scribe.options["jobs"] = None
+        script = scribe.script
+        script.targets["test.ta"] = ["sleep 0.5", "echo A >> " + DIAMOND_LOG]
+        script.targets["test.tb"] = [Reference("needs", ["test.ta"]),
+                                     "echo B >> " + DIAMOND_LOG]
+        script.targets["test.tall"] = "true"
+        script.depends["test.tall"] = ["test.ta", "test.tb"]
+        script.graph.reset()
+        os.unlink(DIAMOND_LOG)
+        scribe.build(["test.tall"])
+        assert_equal(diamond_log(), ["A", "B"])
+    finally:
+        scribe.options["async"] = False
+        scribe.options["jobs"] = jobs
+        diamond_cleanup()
+        for name in ["test.ta", "test.tb", "test.tall"]:
+            scribe.script.targets.pop(name, None)
+        scribe.script.depends.pop("test.tall", None)
+        scribe.script.graph.reset()
+
+def test_invalidate():
+    stats = scribe.stats
+    scribe.script.outputs["test.invalidate"] = ["/tmp/vellum_invalidate.out"]
+    try:
+        stats.stat("/tmp/vellum_invalidate.out")
+        stats.stat("build.vel")
+        scribe.target = "test.invalidate"
+        scribe.invalidate()
+        assert "/tmp/vellum_invalidate.out" not in stats.stats
+        assert stats.key("build.vel") in stats.stats
+
+        scribe.target = None
+        scribe.invalidate()
+        assert not stats.stats
+    finally:
+        del scribe.script.outputs["test.invalidate"]
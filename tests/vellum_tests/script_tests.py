@@ -1,7 +1,7 @@
 # Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
 
 from nose.tools import *
-from vellum.script import Script
+from vellum.script import Script, Graph, CycleError
 
 def test_configure():
     script = Script("build")
@@ -27,3 +27,69 @@ def test_resolve_targets():
     assert 'build' in build
     assert 'tests' in build
 
+
+def test_dag():
+    script = Script("build")
+    building = script.resolve_targets(["build"])
+    graph = script.dag(building)
+    assert_equal(set(graph.keys()), set(building))
+    assert_equal(graph["tests"], ["parser", "testing.run"])
+    assert_equal(graph["parser"], [])
+
+def test_graph():
+    graph = Graph({"a": ["b", "c"], "b": ["d"], "c": ["d"], "d": ["e"]})
+    assert_equal(graph.order("a"), ["e", "d", "b", "c", "a"])
+    assert_equal(graph.resolve(["c", "b"]), ["e", "d", "c", "b"])
+    assert_equal(graph.order("z"), ["z"])
+
+def test_graph_all_orders():
+    # one walk gives every target the order resolving it alone would
+    depends = {"a": ["b", "c"], "b": ["d", "e"], "c": ["e", "d"],
+               "d": ["f"], "e": ["f", "g"], "h": ["c", "a"]}
+    graph = Graph(depends)
+    walks = []
+    resolve = graph.resolve
+    graph.resolve = lambda roots: walks.append(roots) or resolve(roots)
+    orders = graph.all_orders(sorted(depends))
+    assert_equal(len(walks), 1)
+    assert_equal(sorted(orders), list("abcdefgh"))
+    for target in "abcdefgh":
+        assert_equal(orders[target], Graph(depends).resolve([target]))
+
+def test_graph_cycle():
+    graph = Graph({"a": ["b"], "b": ["c"], "c": ["a"]})
+    assert_raises(CycleError, graph.order, "a")
+    assert_raises(CycleError, Graph({"a": ["a"]}).order, "a")
+
+def test_graph_large():
+    # a long chain and a wide layer of diamonds stay linear
+    depends = {}
+    for i in range(10000):
+        depends["chain%d" % i] = ["chain%d" % (i + 1)]
+        depends["wide%d" % i] = ["chain9990", "chain9995"]
+    roots = ["chain0"] + ["wide%d" % i for i in range(10000)]
+    order = Graph(depends).resolve(roots)
+    assert_equal(len(order), 20001)
+    assert_equal(order[0], "chain10000")
+
+def test_no_depends():
+    open("/tmp/vellum_no_depends.vel", "w").write(
+        "options(default 'aa')\ntargets(aa $ echo a\n)\n")
+    script = Script("/tmp/vellum_no_depends")
+    assert_equal(script.depends, {})
+    assert_equal(script.resolve_targets(), ["aa"])
+    script.show()
+
+def test_refresh():
+    recipe = "options(default 'aa')\ndepends(aa %s)\ntargets(aa $ echo a\n bb $ echo b\n cc $ echo c\n)\n"
+    open("/tmp/vellum_refresh_script.vel", "w").write(recipe % "['bb']")
+    script = Script("/tmp/vellum_refresh_script")
+    assert_equal(script.resolve_depends("aa"), ["bb", "aa"])
+
+    open("/tmp/vellum_refresh_script.vel", "w").write(recipe % "['cc']")
+    assert_equal(script.refresh(), [("depends", "aa")])
+    assert_equal(script.resolve_depends("aa"), ["cc", "aa"])
+
+    open("/tmp/vellum_refresh_script.vel", "w").write(recipe % "['bb']" + "imports[]\n")
+    assert_equal(script.refresh(), None)
+    assert_equal(script.resolve_depends("aa"), ["bb", "aa"])
@@ -0,0 +1,64 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.shell import Shell, quote, plain_argv, call
+import os
+
+def test_quote():
+    assert_equal(quote("it's"), "'it'\\''s'")
+
+def test_run():
+    shell = Shell()
+    assert_equal(shell.run("true"), 0)
+    assert_equal(shell.run("false"), 1)
+    assert_equal(shell.run("echo 'quoted' > /dev/null"), 0)
+    assert_equal(shell.close(), 0)
+
+def test_state():
+    shell = Shell()
+    assert_equal(shell.run("cd /tmp"), 0)
+    assert_equal(shell.run('test "`pwd`" = /tmp'), 0)
+    assert_equal(shell.run("export VELLUM_TEST=yes"), 0)
+    assert_equal(shell.run('test "$VELLUM_TEST" = yes'), 0)
+    shell.close()
+
+def test_follows_cwd():
+    shell = Shell()
+    curdir = os.path.abspath(os.curdir)
+    try:
+        os.chdir("/tmp")
+        assert_equal(shell.run('test "`pwd`" = /tmp'), 0)
+    finally:
+        os.chdir(curdir)
+    assert_equal(shell.run('test "`pwd`" = %s' % quote(curdir)), 0)
+    shell.close()
+
+def test_exit_and_errors():
+    shell = Shell()
+    assert_equal(shell.run("exit 3"), 3)
+    assert_equal(shell.run("true"), 0)
+    assert shell.run("echo 'unbalanced") != 0
+    assert_equal(shell.run("true"), 0)
+    shell.close()
+
+def test_high_fds():
+    # with lots of files open the status pipe lands past fd 9
+    files = [open("/dev/null") for i in range(12)]
+    try:
+        shell = Shell()
+        assert_equal(shell.run("true"), 0)
+        assert_equal(shell.run("false"), 1)
+        shell.close()
+    finally:
+        for f in files: f.close()
+
+def test_plain_argv():
+    assert_equal(plain_argv("cp -r 'a file' b"), ["cp", "-r", "a file", "b"])
+    for cmd in ["ls | wc", "echo $HOME", "rm *.pyc", "cd /tmp", 
+                "A=1 make", "make > log", "echo `date`", "echo 'unbalanced"]:
+        assert not plain_argv(cmd), "%r needs a shell" % cmd
+
+def test_call():
+    assert_equal(call(["true"]), 0)
+    assert_equal(call(["false"]), 1)
+    assert_equal(call(["/not/a/program"]), 127)
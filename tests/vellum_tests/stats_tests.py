@@ -0,0 +1,51 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.stats import StatCache
+import os
+import shutil
+
+ROOT = "/tmp/vellum_stats"
+
+def setup():
+    if os.path.exists(ROOT): shutil.rmtree(ROOT)
+    os.makedirs(ROOT + "/sub")
+    open(ROOT + "/one.txt", "w").write("one")
+
+def test_stat():
+    stats = StatCache()
+    assert stats.exists(ROOT + "/one.txt")
+    assert stats.isfile(ROOT + "/one.txt")
+    assert stats.isdir(ROOT + "/sub")
+    assert_equal(stats.stat(ROOT + "/missing.txt"), None)
+    assert_raises(OSError, stats.getmtime, ROOT + "/missing.txt")
+
+    # answers are remembered until they're forgotten
+    open(ROOT + "/missing.txt", "w").write("here now")
+    assert not stats.exists(ROOT + "/missing.txt")
+    stats.forget([ROOT + "/*.txt"])
+    assert stats.exists(ROOT + "/missing.txt")
+    os.unlink(ROOT + "/missing.txt")
+    stats.clear()
+    assert not stats.exists(ROOT + "/missing.txt")
+
+def test_listings():
+    stats = StatCache()
+    stats.listed(ROOT, ["one.txt", "sub"])
+    assert stats.exists(ROOT + "/one.txt")
+    assert not stats.exists(ROOT + "/two.txt")
+    assert_equal(stats.listdir(ROOT + "/sub"), set())
+
+    stats.prime([ROOT + "/one.txt", ROOT + "/two.txt"])
+    assert ROOT + "/one.txt" in stats.stats
+
+def test_chdir():
+    stats = StatCache()
+    here = os.getcwd()
+    try:
+        stats.chdir(ROOT)
+        assert stats.exists("one.txt")
+        assert_equal(stats.key("one.txt"), ROOT + "/one.txt")
+    finally:
+        stats.chdir(here)
+    assert not stats.exists("one.txt")
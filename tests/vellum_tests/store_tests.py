@@ -0,0 +1,26 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.store import Store
+import os
+
+def test_store():
+    store = Store("test_store", root="/tmp/vellum_store")
+    if os.path.exists(store.path): os.unlink(store.path)
+    assert "test" not in store
+    store["test"] = [1, 2, 3]
+    assert store.dirty
+    store.save()
+    assert not store.dirty
+    assert os.path.exists(store.path)
+
+    again = Store("test_store", root="/tmp/vellum_store")
+    assert_equal(again["test"], [1, 2, 3])
+    del again["test"]
+    assert_equal(again.get("test", "gone"), "gone")
+
+def test_bad_store():
+    store = Store("test_bad", root="/tmp/vellum_store")
+    if not os.path.exists("/tmp/vellum_store"): os.makedirs("/tmp/vellum_store")
+    open(store.path, "w").write("not a pickle")
+    assert_equal(store.load(), {})
@@ -0,0 +1,35 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.template import Template, template, references
+from vellum.parser import Reference
+from vellum.scope import Scope
+
+OPTIONS = Scope({"file": "aa.py", "count": 3}, {"name": "vellum", "list": ["aa", "bb"], "f(x)": "fx"})
+
+def same(text):
+    try:
+        expected = text % OPTIONS
+    except Exception, err:
+        assert_raises(type(err), Template(text).render, OPTIONS)
+    else:
+        assert_equal(Template(text).render(OPTIONS), expected)
+
+def test_render():
+    for text in ["plain", "100%%", "%(file)s", "lint %(file)s %(name)r %(file)s",
+                 "%(count)05d|%(count)-3d|%(count).2f", "%(list)s", "%(f(x))s",
+                 u"unicode %(name)s", "%(missing)s", "%(file)d", "%(count)*d",
+                 "%(file)q", "%(file", "trailing %", "%s", "%(count)%"]:
+        same(text)
+
+def test_keys():
+    assert_equal(Template("%(file)s %(name)s %(file)r 50%%").keys, frozenset(["file", "name"]))
+    assert_equal(Template("plain").keys, frozenset())
+    assert Template("%s").whole
+    assert not Template("%(file)s").whole
+    assert template("%(file)s") is template("%(file)s")
+
+def test_references():
+    body = ["echo %(name)s", Reference("forall", {"files": "*.py", "do": [
+                Reference("py", "print '%(file)s'"), "cc %(cflags)s %(file)s"]})]
+    assert_equal(references(body), set(["name", "file", "cflags"]))
@@ -0,0 +1,80 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.watcher import Watcher, Inotify, walk, spec_root, matches, affected
+from vellum.script import Script
+from vellum.scribe import Scribe
+import os
+import shutil
+
+ROOT = "/tmp/vellum_watch"
+RECIPE = """options(default 'all')
+depends(all ['parser' 'docs'])
+inputs(parser ['src/*.g'])
+targets(
+    parser $ echo parser
+    docs forall(files '*.tex' top 'doc' do [
+        $ echo %(file)s
+    ])
+    all $ echo all
+)
+"""
+
+def setup():
+    if os.path.exists(ROOT): shutil.rmtree(ROOT)
+    os.makedirs(ROOT + "/sub")
+
+def check_watcher(poll):
+    setup()
+    watcher = Watcher([ROOT], debounce=0.05, poll=poll)
+    assert_equal(watcher.wait(0), set())
+
+    open(ROOT + "/one.txt", "w").write("one")
+    open(ROOT + "/sub/two.txt", "w").write("two")
+    changed = watcher.wait(1)
+    assert ROOT + "/one.txt" in changed
+    assert ROOT + "/sub/two.txt" in changed
+
+    # new directories get watched too
+    os.makedirs(ROOT + "/new")
+    watcher.wait(1)
+    open(ROOT + "/new/three.txt", "w").write("three")
+    assert ROOT + "/new/three.txt" in watcher.wait(1)
+
+    # but not ones forall ignores, like build output
+    for name in ["build", "vellum.egg-info"]:
+        os.makedirs(ROOT + "/" + name)
+        watcher.wait(1)
+        open(ROOT + "/%s/four.txt" % name, "w").write("four")
+        assert_equal(watcher.wait(0.3), set())
+    watcher.close()
+
+def test_walk_ignores():
+    setup()
+    for name in ["build", "dist", "vellum.egg-info", ".git", "sub/dist"]:
+        os.makedirs(os.path.join(ROOT, name))
+    assert_equal(sorted([dir for dir, files in walk(ROOT)]), [ROOT, ROOT + "/sub"])
+
+def test_watcher():
+    assert isinstance(Watcher([]).backend, Inotify)
+    check_watcher(False)
+
+def test_poller():
+    check_watcher(True)
+
+def test_specs():
+    assert_equal(spec_root("vellum/*.py"), "vellum")
+    assert_equal(spec_root("build.vel"), ".")
+    assert_equal(spec_root("tests"), "tests")
+    assert matches("vellum/*.py", "vellum/bin.py")
+    assert matches("tests", "tests/vellum_tests/bin_tests.py")
+    assert matches("./build.vel", "build.vel")
+    assert not matches("build.vel", "build.velx")
+
+def test_affected():
+    open("/tmp/vellum_watch.vel", "w").write(RECIPE)
+    scribe = Scribe(Script("/tmp/vellum_watch"))
+    assert_equal(affected(scribe, ["parser", "docs"], ["src/parser.g"]), ["parser"])
+    assert_equal(affected(scribe, ["parser", "docs"], ["doc/manual.tex"]), ["docs"])
+    assert_equal(affected(scribe, ["parser", "docs"], ["README"]), [])
+    assert_equal(affected(scribe, [], ["src/parser.g"]), ["all"])
@@ -0,0 +1,47 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from nose.tools import *
+from vellum.scribe import Scribe
+from vellum.script import Script
+from vellum.parser import Reference
+from vellum.workers import shell_only, run_each
+from StringIO import StringIO
+import os
+import sys
+
+def setup():
+    global scribe
+    scribe = Scribe(Script("build"))
+
+def test_shell_only():
+    assert shell_only(scribe, ["echo one", Reference("log", "hi")])
+    assert shell_only(scribe, "echo one\necho two")
+    assert not shell_only(scribe, ["echo one", Reference("py", "print 1")])
+    assert not shell_only(scribe, Reference("cd", {"to": "tests"}))
+
+    scribe.options["persistent"] = True
+    try:
+        assert not shell_only(scribe, ["echo one"])
+    finally:
+        del scribe.options["persistent"]
+
+def test_run_each():
+    scope = lambda f: {"file": f}
+    here = os.getcwd()
+    assert_equal(run_each(scribe, ["aa", "bb", "cc"], 2, ["test %(file)s != bb"], scope), 1)
+    assert_equal(run_each(scribe, ["aa", "bb"], 2, [Reference("py", "assert file != 'bb'")], scope), 1)
+    assert_equal(run_each(scribe, ["aa", "bb"], 2, [Reference("cd", {"to": "tests"})], scope), 0)
+    assert_equal(os.getcwd(), here)
+
+def test_forked_output():
+    # like the daemon, sys.stdout isn't fd 1, and a child's print
+    # still has to come back through its pipe
+    scope = lambda f: {"file": f}
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        run_each(scribe, ["aa", "bb"], 2, [Reference("py", "print 'from', file")], scope)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    assert_equal(sorted(output.splitlines()), ["from aa", "from bb"])
@@ -1,15 +1,11 @@
 # Copyright (C) 2008 Zed A. Shaw. Licensed under the terms of the GPLv3.
 
-from optparse import OptionParser
+# Only what every run needs is imported here.  vellum gets run
+# constantly from editors and scripts, so each mode below imports
+# the rest itself and -v never loads the parser at all.
 import sys
 import vellum
-from vellum.press import Press
-from vellum.scribe import Scribe
-from vellum.script import Script
-from pprint import pprint
 from vellum.version import VERSION
-import re
-from pprint import pformat
 import time
 import os
 
@@ -41,7 +37,21 @@ options = [
  ("-S", "--search", "search_commands", 
   "Search commands with a regex.", "store_true", False),
  ("-w", "--watch", "watch_file", 
-  "Watch a file and run the targets whenever it changes.", "store", None),
+  "Watch a file, directory, or glob (more than one -w is fine) and rebuild what changes affect.", "append", None),
+ ("-j", "--jobs", "jobs", 
+  "Run up to N targets at once when their depends allow.", "store", None),
+ ("-c", "--cache", "cache", 
+  "Restore declared outputs from the ~/.vellum/cache build cache.", "store_true", False),
+ ("-R", "--remote-cache", "remote_cache", 
+  "URL of a shared HTTP build cache (see vellum.cacheserver).", "store", None),
+ ("-P", "--persistent", "persistent", 
+  "Run each target's shell lines in one long-lived shell.", "store_true", False),
+ ("-x", "--direct", "direct", 
+  "Exec plain shell lines directly instead of through /bin/sh.", "store_true", False),
+ ("-a", "--async", "async", 
+  "Run all targets' shell lines from one event loop (-j limits them).", "store_true", False),
+ ("-B", "--daemon", "daemon", 
+  "Keep the build loaded and serve vellum runs from .vellum/daemon.sock.", "store_true", False),
 ]
 ### @end
 
@@ -52,6 +62,7 @@ def parse_sys_argv(argv):
     Expects the sys.argv[1:] to parse and then returns
     an options hash combined with the args.
     """
+    from optparse import OptionParser
     parser = OptionParser()
     for opt, long, dest, help, action, default in options:
         parser.add_option(opt, long, 
@@ -70,6 +81,8 @@ def dump(options):
     Dumps the build file and all imported files it has
     as a giant Python search.
     """
+    from vellum.press import Press
+    from pprint import pprint
     press = Press(options["filename"], options)
     pprint(press.main)
 
@@ -77,6 +90,7 @@ def install(options, script):
     """
     Installs the ~/.vellum dir and what it needs.
     """
+    from vellum.scribe import Scribe
     scribe = Scribe(script)
     scribe.log("Installing .vellum directory to your home directory.")
     scribe.command("install", None)
@@ -98,6 +112,7 @@ def shell(options, script, user_input=raw_input):
     user_input is a function that gets called, defaults
     to raw_input, but during testing it is stubbed out.
     """
+    from vellum.scribe import Scribe
     scribe = Scribe(script)
     script.show()
     while True:
@@ -106,12 +121,16 @@ def shell(options, script, user_input=raw_input):
             targets = user_input()
         except EOFError:
             break
+        if script.refresh() is None:
+            scribe = Scribe(script)
         scribe.build(targets.split(" "))
 
 ### @export "building with Scribe"
-def build(options, script, targets):
-    """Builds the targets."""
-    scribe = Scribe(script)
+def build(options, script, targets, scribe=None):
+    """Builds the targets, with a new Scribe unless one is given."""
+    if not scribe:
+        from vellum.scribe import Scribe
+        scribe = Scribe(script)
     scribe.build(targets)
 
 ### @export "implementation of -S"
@@ -120,6 +139,8 @@ def search(options, script, regex):
     Searches through all available targets for anything that matches the
     given regex(es) in their name or their commands.
     """
+    from pprint import pformat
+    import re
     search = re.compile("^.*(" + " ".join(regex) + ").*$")
 
     commands = [cmd for cmd in script.commands
@@ -144,34 +165,52 @@ def search(options, script, regex):
 
 def watch(options, script, targets, count=None, sleep_time=2):
     """
-    Runs in a delayed loop looking at a single file, and then
-    runs the targets.  The count parameter is only really
+    Watches the files, directories, and globs given with -w (and
+    the recipes) and after each burst of changes builds the targets
+    those changes affect.  Changing a recipe refreshes the script
+    and builds all of them.  The count parameter is only really
     used in tests.
     """
-    watching = options["watch_file"]
-    stats = repr(os.stat(watching))
-    print "Watching file %r for changes and running %r targets:" % (watching, targets)
+    from vellum.watcher import Watcher, spec_root, matches, affected
+    from vellum.scribe import Scribe
+    specs = options["watch_file"]
+    recipes = set([os.path.normpath(f) for f in script.press.sources])
+    watcher = Watcher(set([spec_root(s) for s in specs] + 
+                          [spec_root(r) for r in recipes]))
+    print "Watching %r for changes and running %r targets:" % (specs, targets)
 
     while True:
         try:
-            time.sleep(sleep_time)
+            changed = watcher.wait(sleep_time)
         except KeyboardInterrupt:
             print "Interrupted:  Hit enter to force a run, CTRL-C again to stop."
             try:
                 keep_going = raw_input()
-                stats = ""  # makes sure it's different
+                changed = None  # makes sure everything runs
             except KeyboardInterrupt:
                 print "Goodbye."
+                watcher.close()
                 sys.exit(0)
 
-        test = repr(os.stat(watching))
-        if test != stats:
-            print "File %r changed, running targets: %r" % (watching, targets)
-            stats = test
-            try:
-                build(options, script, targets)
-            except vellum.DieError, err:
-                print "ERROR: %s" % err
+        try:
+            if changed is None:
+                to_build = targets
+            else:
+                changed = sorted([p for p in changed if p in recipes or
+                                  [s for s in specs if matches(s, p)]])
+                if [p for p in changed if p in recipes]:
+                    script.refresh()
+                    to_build = targets
+                elif changed:
+                    to_build = affected(Scribe(script), targets, changed) or None
+                else:
+                    to_build = None
+
+            if to_build is not None:
+                print "Files %r changed, running targets: %r" % (changed, to_build)
+                build(options, script, to_build)
+        except vellum.DieError, err:
+            print "ERROR: %s" % err
 
         # handle where only a set number is requested
         if count:
@@ -179,33 +218,69 @@ def watch(options, script, targets, count=None, sleep_time=2):
             if count <= 0:
                 break
 
+    watcher.close()
+
+def daemon_socket(options):
+    """Where the daemon for this build file listens."""
+    return os.path.join(os.path.dirname(options["filename"]), 
+                        ".vellum", "daemon.sock")
+
 ### @export "the start of the world"
 def run(argv=sys.argv):
     """
     Main entry for the entire program, it parses the command
     line arguments and then runs the other methods in this
-    file to make Vellum actually work.
+    file to make Vellum actually work.  If a daemon is running
+    for the build the arguments are handed to it instead.
     """
     options, args = parse_sys_argv(argv)
+    if options["show_version"]:
+        print VERSION
+        return
+    elif options["daemon"]:
+        from vellum.daemon import Daemon
+        Daemon(options, daemon_socket(options)).serve()
+        return
+    elif not (options["shell"] or options["watch_file"]):
+        if os.path.exists(daemon_socket(options)):
+            from vellum.daemon import forward
+            status = forward(daemon_socket(options), argv)
+            if status is not None:
+                if status: sys.exit(status)
+                return
+
+    status = execute(options, args)
+    if status: sys.exit(status)
 
+def execute(options, args, script=None, scribe=None):
+    """
+    Loads the script (unless it's given) and runs what the
+    options ask for, returning the exit status.  The daemon
+    calls this with the script and Scribe it keeps around.
+    """
     try:
-        script = Script(options["filename"], options)
+        if options["dump"]: 
+            dump(options)
+            return 0
+
+        if not script:
+            from vellum.script import Script
+            script = Script(options["filename"], options)
         opts = script.options
         if opts["show_targets"]: show_targets(options, script)
-        elif opts["dump"]: dump(options)
         elif opts["install"]: install(options, script)
         elif opts["shell"]: shell(options, script)
-        elif opts["show_version"]: print VERSION
         elif opts["list_commands"]: commands(options, script, args)
         elif opts["search_commands"]: search(options, script, args)
         elif opts["watch_file"]: watch(options, script, args)
-        else: build(options, script, args)
+        else: build(options, script, args, scribe)
     except vellum.DieError, err:
         print "ERROR: %s" % err
         print "Exiting (use -k to keep going)"
-        sys.exit(1)
+        return 1
     except vellum.ImportError, err:
         print "%s\nFix your script." % err
+    return 0
 ### @end
 
 
@@ -0,0 +1,233 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from __future__ import with_statement
+from cStringIO import StringIO
+import fnmatch
+import hashlib
+import os
+import tarfile
+import tempfile
+import threading
+
+# default size cap in megabytes, override with the cache_size option
+CACHE_SIZE = 1024
+
+class Cache(object):
+    """
+    A content addressed store of target outputs kept in ~/.vellum/cache.
+    Each entry is a tar of a target's outputs named by a hash of
+    everything that went into making them, so switching branches
+    or cleaning a tree can restore outputs instead of rebuilding.
+    Entries are evicted least recently used first once the cache
+    grows past max_size megabytes.  The size is only counted up from
+    a walk of the cache the first time it's written to, so the walk
+    again to evict only happens once that count goes over.
+
+    If a RemoteCache is given then local misses are looked for
+    there, and everything stored locally is uploaded to it.
+    """
+
+    def __init__(self, root="~/.vellum/cache", max_size=CACHE_SIZE, remote=None):
+        self.root = os.path.expanduser(root)
+        self.max_size = int(max_size) * 1024 * 1024
+        self.remote = remote
+        self.size = None
+        self.lock = threading.Lock()
+
+    ### @export "cache keys"
+    def key(self, *parts):
+        """Hashes all of the parts into one key."""
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(repr(part))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    ### @export "packing outputs"
+    def pack(self, outputs):
+        """
+        Tars up the outputs, marking each as relative or absolute
+        so relative ones come back into whatever directory is
+        current when they're restored.
+        """
+        data = StringIO()
+        tar = tarfile.open(mode="w", fileobj=data)
+        for output in outputs:
+            tar.add(output, self.member_name(output))
+        tar.close()
+        return data.getvalue()
+
+    def member_name(self, output):
+        where = "abs" if os.path.isabs(output) else "rel"
+        return "%s/%s" % (where, os.path.normpath(output).lstrip("/"))
+
+    def unpack(self, data, outputs):
+        """
+        Restores what pack() made, touching each file so it's fresh,
+        and returns how many members it extracted.  Entries can come
+        from a shared cache, so only members matching the declared
+        outputs (globs are fine), or in a directory that does, are
+        extracted, and ones with .. in them, links out of the tree,
+        and devices are skipped no matter what they're called.
+        """
+        wanted = [self.member_name(output) for output in outputs]
+        extracted = 0
+        tar = tarfile.open(mode="r", fileobj=StringIO(data))
+        for member in tar.getmembers():
+            if not self.trusted(member, wanted): continue
+            where, member.name = member.name.split("/", 1)
+            root = "/" if where == "abs" else "."
+            tar.extract(member, root)
+            extracted += 1
+            if member.isfile():
+                os.utime(os.path.join(root, member.name), None)
+        tar.close()
+        return extracted
+
+    def trusted(self, member, wanted):
+        """Tells if unpack() can extract member for the wanted outputs."""
+        parts = member.name.split("/")
+        if member.name.startswith("/") or ".." in parts: return False
+        paths = ["/".join(parts[:i]) for i in range(2, len(parts) + 1)]
+        if not [p for p in paths for w in wanted if fnmatch.fnmatchcase(p, w)]:
+            return False
+        if member.issym() or member.islnk():
+            link = member.linkname
+            return not (link.startswith("/") or ".." in link.split("/"))
+        return member.isfile() or member.isdir()
+
+    ### @export "getting and putting"
+    def get(self, key):
+        """
+        Returns the entry's data or None, marking it recently used.
+        Entries found in the remote cache are kept locally.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+            return data
+        except (IOError, OSError):
+            data = self.remote.get(key) if self.remote else None
+            if data is not None: self.write(key, data)
+            return data
+
+    def put(self, key, data):
+        """Writes an entry locally and to the remote cache if there is one."""
+        self.write(key, data)
+        if self.remote: self.remote.put(key, data)
+
+    def write(self, key, data):
+        """
+        Writes an entry and then evicts if it's over the size cap.
+        The cache server writes from many threads, so each write
+        gets its own temp file and the size is counted under a lock.
+        """
+        path = self.path(key)
+        with self.lock:
+            if self.size is None: self.size = self.total()
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(path)): raise
+
+        fd, temp = tempfile.mkstemp(prefix=key + ".", dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(temp, 0644)
+        with self.lock:
+            old = os.path.exists(path) and os.path.getsize(path)
+            os.rename(temp, path)
+            self.size += len(data) - old
+            if self.size > self.max_size: self.evict()
+
+    def fetch(self, key, outputs):
+        """
+        Restores the outputs for key, returning False on a miss or
+        when nothing in the entry was one of the outputs.
+        """
+        data = self.get(key)
+        if data is None: return False
+        return self.unpack(data, outputs) > 0
+
+    def store(self, key, outputs):
+        self.put(key, self.pack(outputs))
+
+    ### @export "eviction"
+    def entries(self):
+        """Lists (mtime, size, path) for everything in the cache."""
+        entries = []
+        for path, dirs, files in os.walk(self.root):
+            for name in files:
+                try:
+                    st = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue  # evicted by another vellum
+                entries.append((st.st_mtime, st.st_size, os.path.join(path, name)))
+        return entries
+
+    def total(self):
+        return sum([size for mtime, size, path in self.entries()])
+
+    def evict(self):
+        """
+        Removes the least recently used entries until under max_size.
+        Other vellums can share the cache, so this counts the size
+        again from what's really there.
+        """
+        entries = self.entries()
+        entries.sort()
+        total = sum([size for mtime, size, path in entries])
+        while total > self.max_size and entries:
+            mtime, size, path = entries.pop(0)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+
+### @export "class RemoteCache"
+class RemoteCache(object):
+    """
+    Talks to a shared build cache over plain HTTP.  The protocol
+    is just GET /key to fetch an entry (404 if missing) and PUT /key
+    to store one, so anything from vellum.cacheserver to a plain
+    WebDAV share will work.  A broken or missing server only
+    turns into cache misses, it never stops a build.
+    """
+
+    # httplib and friends cost more to import than a whole local
+    # build takes, so they're only loaded when there's a remote
+
+    def __init__(self, url, timeout=10):
+        import urlparse
+        parts = urlparse.urlsplit(url)
+        self.host = parts[1]
+        self.prefix = parts[2].rstrip("/") + "/"
+        self.timeout = timeout
+
+    def request(self, method, key, data=None):
+        """Does one request, returning (status, body) or (None, None)."""
+        import httplib, socket
+        try:
+            conn = httplib.HTTPConnection(self.host, timeout=self.timeout)
+            conn.request(method, self.prefix + key, data)
+            resp = conn.getresponse()
+            body = resp.read()
+            conn.close()
+            return resp.status, body
+        except (socket.error, httplib.HTTPException):
+            return None, None
+
+    def get(self, key):
+        status, body = self.request("GET", key)
+        return body if status == 200 else None
+
+    def put(self, key, data):
+        status, body = self.request("PUT", key, data)
+        return status in (200, 201, 204)
@@ -0,0 +1,77 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+"""
+A small reference server for the remote build cache.  It speaks
+the GET/PUT protocol that vellum.cache.RemoteCache uses and keeps
+its entries in a vellum.cache.Cache, so it evicts the same way.
+
+Usage: python -m vellum.cacheserver [directory] [port] [size in MB]
+"""
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from vellum.cache import Cache, CACHE_SIZE
+import re
+import sys
+
+KEY = re.compile("^[0-9a-f]{40}$")
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """Handles GET and PUT of cache entries named by their key."""
+
+    def key(self):
+        """Pulls the key off the end of the path, None if it's bad."""
+        key = self.path.rstrip("/").split("/")[-1]
+        return key if KEY.match(key) else None
+
+    def reply(self, status, body=""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        key = self.key()
+        data = self.server.cache.get(key) if key else None
+        if data is None:
+            self.reply(404)
+        else:
+            self.reply(200, data)
+
+    def do_PUT(self):
+        key = self.key()
+        if not key:
+            self.reply(400)
+        else:
+            length = int(self.headers.get("Content-Length", 0))
+            self.server.cache.put(key, self.rfile.read(length))
+            self.reply(201)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class CacheServer(ThreadingMixIn, HTTPServer):
+    """A threaded HTTPServer that serves one Cache."""
+    daemon_threads = True
+
+    def __init__(self, address, cache, verbose=False):
+        HTTPServer.__init__(self, address, CacheHandler)
+        self.cache = cache
+        self.verbose = verbose
+
+
+def serve(root="~/.vellum/server", port=8765, max_size=CACHE_SIZE):
+    """Runs a CacheServer on localhost until it's interrupted."""
+    server = CacheServer(("127.0.0.1", int(port)), 
+                         Cache(root, max_size), verbose=True)
+    print "Serving the build cache in %s at http://127.0.0.1:%d/" % (
+        server.cache.root, server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print "Goodbye."
+
+if __name__ == '__main__':
+    serve(*sys.argv[1:])
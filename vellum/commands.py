@@ -1,24 +1,40 @@
 from __future__ import with_statement
 # Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
 
+from vellum.index import IGNORE, Matches
+from vellum.manifest import Changes
 import os
 import sys
-import fnmatch
 import subprocess
+import vellum.shell
+import vellum.workers
 
 def sh(scribe, expr):
     """
     Runs the given list of strings or string as a shell
-    command, aborting if the command exits with 0.
+    command, aborting if the command exits with 0.  With
+    the persistent option every line of a target runs in
+    the same shell, so cd and export carry over.  With the
+    direct option lines that don't need a shell are run
+    without one.
 
     Usage: sh 'echo "test"'
     """
     formatted = scribe.interpolate("sh", "".join(expr))
     scribe.log(" sh: %r" % formatted)
     if not scribe.option("dry_run"):
-        retcode = subprocess.call(formatted, 
-                shell=True, stderr=1, stdout=1)
+        argv = scribe.option("direct") and vellum.shell.plain_argv(formatted)
+        if scribe.output is not None:
+            retcode = vellum.shell.capture(argv or formatted, scribe.output)
+        elif scribe.option("persistent"):
+            retcode = scribe.persistent_shell().run(formatted)
+        elif argv:
+            retcode = vellum.shell.call(argv)
+        else:
+            retcode = subprocess.call(formatted, 
+                    shell=True, stderr=1, stdout=1)
                 
+        scribe.invalidate()
         if retcode != 0: scribe.die(expr)
 
 def py(scribe, expr):
@@ -26,14 +42,16 @@ def py(scribe, expr):
     Runs the given list of strings or string as a python
     statements.  It doesn't stop, but if you raise an
     exception this will obviously stop the processing.
-    You have access to all the options as globals.
+    You have access to all the options as globals, and
+    to the scribe, script, and stats (the StatCache).
 
     Usage: py 'print "hi"'
     """
     formatted = scribe.interpolate("py", "".join(expr))
     scribe.log(" py: %r" % formatted)
     if not scribe.option("dry_run"):
-        scribe.push_scope({"scribe": scribe, "script": scribe.script})
+        scribe.push_scope({"scribe": scribe, "script": scribe.script,
+                           "stats": scribe.stats})
         exec(formatted, globals(), scribe.options)
         scribe.pop_scope()
 
@@ -65,10 +83,13 @@ def given(scribe, expr, name='given'):
     Evaluates the list of strings or string as a Python
     expression (not statement) and if that expression is
     False stops processing this target.  Read it as:
-      given X is True continue.
+      given X is True continue.  The StatCache is there
+    as stats, so checking files doesn't have to stat them
+    every time.
 
-    Usage: given 'os.path.exists("/etc/passwd")'
+    Usage: given 'stats.exists("/etc/passwd")'
     """
+    stats = scribe.stats
     formatted = scribe.interpolate("given", "".join(expr))
     scribe.log(" %s: %r" % (name, formatted))
 
@@ -108,6 +129,7 @@ def gen(scribe, input=None, output=None, **expr):
     with open(input) as inp:
         with open(output,'w') as out:
             out.write(inp.read() % expr)
+    scribe.stats.forget([output])
 
 def install(scribe, expr):
     """
@@ -131,15 +153,17 @@ def mkdirs(scribe, paths=[], mode=0700):
 
     Usage:  mkdirs(paths ["path1","path2"] mode 0700)
     """
-    assert isinstance(paths, list), "mkdirs expects a list as the expression"
+    assert isinstance(paths, (list, tuple)), "mkdirs expects a list as the expression"
 
     for dir in (os.path.expanduser(p) for p in paths):
         scribe.log(" mkdir: %s" % dir)
-        if not (os.path.exists(dir) or scribe.option("dry_run")):
+        if not (scribe.stats.exists(dir) or scribe.option("dry_run")):
             os.makedirs(dir, mode=0700)
+            scribe.stats.forget([dir])
 
 ### @export "forall"
-def forall(scribe, files=None, do=[], top=".", var="file"):
+def forall(scribe, files=None, do=[], top=".", var="file", ignore=[],
+           stream=0, jobs=1, changed=0, digest=0):
     """
     Iterates the commands in a do block over all the files
     matching a given regex recursively.  You can put anything
@@ -153,6 +177,27 @@ def forall(scribe, files=None, do=[], top=".", var="file"):
     nest forall expressions then you'll need to give each one
     a different name (just like in a real language).
 
+    Directories like .git, build, and dist aren't searched (see
+    vellum.index.IGNORE) and you can skip more by giving a list
+    of patterns in 'ignore'.  A pattern that starts with plain
+    directories, like "./vellum/*.py", only searches under them.
+
+    For huge trees give 'stream 1' and the do block runs on each
+    file as the search finds it, without keeping a list of them.
+    Then 'files' is searched again each time it's used, and
+    files the do block makes may turn up later in the search.
+
+    Give 'jobs 4' to run the do block on 4 files at once.  A block
+    of only shell lines runs on threads, anything else runs each
+    file in a process of its own, and what each file prints comes
+    out together when it's done.
+
+    With 'changed 1' the do block only runs for files that are
+    new or changed since it last worked on them (see
+    vellum.manifest), and 'digest 1' also compares contents so
+    a file that was only touched is still skipped.  Changing the
+    do block or an option it uses, or -F, runs them all again.
+
     Usage: forall(files "*.py" var "file" do [ ... ])
     """
     scribe.log("forall: files %r top %r var %r" % (files, top, var))
@@ -160,16 +205,39 @@ def forall(scribe, files=None, do=[], top=".", var="file"):
         scribe.die("forall", "Must give a file matching "
                    "pattern in parameter 'files'.")
 
-    matches = []
-    for path, dirs, fnames in os.walk(top):
-        paths = (os.path.join(path,f) for f in fnames)
-        matches.extend(fnmatch.filter(paths, files))
+    if stream:
+        matches = Matches(top, files, IGNORE + list(ignore))
+    else:
+        matches = scribe.files.files(top, files, IGNORE + list(ignore))
+        scribe.log("forall: matched %d files." % len(matches))
 
-    scribe.log("forall: matched %d files." % len(matches))
-    for f in matches:
-        scribe.push_scope({var: f, "files": matches, "var": var})
-        scribe.execute(do)
-        scribe.pop_scope()
+    todo = matches
+    if changed:
+        todo = Changes(scribe.manifests, (scribe.target, top, files, var), do,
+                       matches, digest, scribe.option("force"), scribe.options)
+
+    try:
+        if int(jobs) > 1:
+            failed = vellum.workers.run_each(scribe, todo, int(jobs), do,
+                    lambda f: {var: f, "files": matches, "var": var},
+                    changed and todo.done)
+            if failed: scribe.die("forall", "%d files failed." % failed)
+            return
+
+        count = 0
+        for f in todo:
+            errors = scribe.errors
+            scribe.push_scope({var: f, "files": matches, "var": var})
+            scribe.execute(do)
+            scribe.pop_scope()
+            if changed: todo.done(f, errors == scribe.errors)
+            count += 1
+
+        if stream: scribe.log("forall: streamed %d files." % count)
+    finally:
+        if changed:
+            scribe.log("forall: %d files changed." % todo.count)
+            if not scribe.option("dry_run"): todo.record()
 
 ### @export "cd"
 def cd(scribe, to=None, do=[]):
@@ -183,15 +251,15 @@ def cd(scribe, to=None, do=[]):
 
     if not to: 
         scribe.die("cd", "Must specify to parameter to cd into.")
-    elif not os.path.exists(to):
+    elif not scribe.stats.exists(to):
         scribe.die("cd", "Target chdir path '%s' does not exist." % to)
 
     curdir = os.path.abspath(os.path.curdir)
     try:
-        os.chdir(to)
+        scribe.stats.chdir(to)
         scribe.push_scope({"parent": curdir})
         scribe.execute(do)
         scribe.pop_scope()
     finally:
-        os.chdir(curdir)
+        scribe.stats.chdir(curdir)
 
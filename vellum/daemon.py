@@ -0,0 +1,191 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from vellum.bin import parse_sys_argv, execute
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+
+# written after a request's output, followed by the exit status
+SENTINEL = "\0VELLUM-EXIT "
+
+# sent instead of a status when the client has to run the build itself
+REFUSED = "refused"
+
+### @export "class Daemon"
+class Daemon(object):
+    """
+    Keeps one build's Script (with its parsed recipes and the
+    commands it has imported) and Scribe (with its ledger,
+    signatures, and cache) loaded, and runs every vellum command
+    line a client forwards against them.  Before each run the
+    script is refreshed, so edited recipes are picked up without
+    starting over.
+
+    Requests are run one at a time, since each one takes over
+    stdout and stderr so that the commands it runs write straight
+    to the client.  Each runs with the client's environment, and
+    one from another directory is refused so the client runs it,
+    since the recipes were loaded relative to the daemon's.
+    """
+
+    def __init__(self, options, path):
+        from vellum.script import Script
+        from vellum.scribe import Scribe
+        self.path = path
+        self.cwd = os.getcwd()
+        self.script = Script(options["filename"], options)
+        self.scribe = Scribe(self.script)
+
+    def serve(self, count=None):
+        """Answers requests on the socket, forever or for count of them."""
+        if os.path.exists(self.path):
+            if forward(self.path, None) is not None:
+                print "A daemon is already running on %s." % self.path
+                return
+            os.unlink(self.path)
+        elif not os.path.exists(os.path.dirname(self.path) or "."):
+            os.makedirs(os.path.dirname(self.path))
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(5)
+        try:
+            signal.signal(signal.SIGTERM, stop)
+        except ValueError:
+            pass  # only the main thread can, so tests go without
+        print "Serving %s (CTRL-C to stop)" % self.path
+        try:
+            while count is None or count > 0:
+                conn, addr = server.accept()
+                try:
+                    self.handle(conn)
+                finally:
+                    conn.close()
+                if count: count -= 1
+        except KeyboardInterrupt:
+            print "Goodbye."
+        finally:
+            server.close()
+            os.unlink(self.path)
+
+    def handle(self, conn):
+        """Reads one request off conn and runs it, ending with the status."""
+        line = conn.makefile().readline()
+        if not line: return  # just checking if we're alive
+        request = json.loads(line)
+        if request.get("cwd") != self.cwd:
+            conn.sendall(SENTINEL + REFUSED + "\n")
+            return
+
+        argv = [arg.encode("utf-8") for arg in request["argv"]]
+        env = dict([(k.encode("utf-8"), v.encode("utf-8"))
+                    for k, v in request["env"].items()])
+        options, args = parse_sys_argv(argv)
+        environ = dict(os.environ)
+        os.environ.clear()
+        os.environ.update(env)
+        try:
+            status = self.run(conn, options, args)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        conn.sendall(SENTINEL + "%d\n" % status)
+
+    ### @export "running a request"
+    def run(self, conn, options, args):
+        """
+        Runs one request with fds 1 and 2 (and sys.stdout/stderr)
+        pointed at conn, returning its exit status.
+        """
+        out = conn.makefile("w", 0)
+        files = sys.stdout, sys.stderr
+        sys.stdout.flush()
+        sys.stderr.flush()
+        fds = os.dup(1), os.dup(2)
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        sys.stdout = sys.stderr = out
+        try:
+            try:
+                return execute(options, args, self.script, self.scribe_for(options))
+            except SystemExit, err:
+                return err.code or 0
+            except Exception:
+                traceback.print_exc()
+                return 1
+        finally:
+            sys.stdout, sys.stderr = files
+            os.dup2(fds[0], 1)
+            os.dup2(fds[1], 2)
+            os.close(fds[0])
+            os.close(fds[1])
+
+    def scribe_for(self, options):
+        """
+        Brings the script up to date with the recipes and this
+        request's options, then picks the Scribe to run it.  Dry
+        runs and forced builds get one with a fresh ledger so that
+        what they pretend to build isn't remembered as done.
+        """
+        from vellum.scribe import Scribe
+        self.script.defaults = options
+        if self.script.refresh() is None:
+            self.scribe = Scribe(self.script)
+        self.script.options.update(options)
+
+        if options["dry_run"] or options["force"]:
+            scribe = Scribe(self.script)
+            scribe.signatures = self.scribe.signatures
+            scribe.files = self.scribe.files
+            scribe.manifests = self.scribe.manifests
+            scribe.cache = self.scribe.cache
+            return scribe
+        return self.scribe
+
+def stop(signum, frame):
+    """Makes a kill stop the daemon the same way CTRL-C does."""
+    raise KeyboardInterrupt()
+
+### @export "the client"
+def forward(path, argv, out=None):
+    """
+    Sends argv, with the current directory and environment, to
+    the daemon on path and copies everything it writes back to
+    out as it arrives.  Returns the exit status, or None if
+    there's no daemon listening or it refused, so the caller can
+    just run the build itself.  With argv None this only checks
+    that a daemon answers.
+    """
+    out = out or sys.stdout
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except socket.error:
+        return None
+    if argv is None:
+        client.close()
+        return 0
+
+    request = {"argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ)}
+    client.sendall(json.dumps(request) + "\n")
+    keep = len(SENTINEL) + 12  # enough to hold back the whole sentinel
+    tail = ""
+    while True:
+        data = client.recv(4096)
+        if not data: break
+        data = tail + data
+        out.write(data[:-keep])
+        out.flush()
+        tail = data[-keep:]
+    client.close()
+
+    at = tail.rfind(SENTINEL)
+    if at < 0:
+        out.write(tail)
+        return 1  # the daemon died part way through
+    out.write(tail[:at])
+    status = tail[at + len(SENTINEL):].strip()
+    return None if status == REFUSED else int(status)
@@ -0,0 +1,222 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from vellum import DieError
+from vellum.shell import plain_argv
+import errno
+import os
+import select
+import signal
+import subprocess
+import sys
+
+### @export "class Job"
+class Job(object):
+    """
+    One Scribe working through the shell lines yielded by its
+    steps generator, with the process for the current line and
+    whatever part of an output line hasn't been written yet.
+    """
+
+    def __init__(self, scribe, steps, done):
+        self.scribe = scribe
+        self.steps = steps
+        self.done = done
+        self.cmd = None
+        self.proc = None
+        self.pipes = {}
+
+
+### @export "class Wait"
+class Wait(object):
+    """
+    Yielded by a Job's steps instead of a shell line when a target
+    it needs is being run by another Job.  The Engine puts the Job
+    aside until the ledger says that target isn't running anymore.
+    """
+
+    def __init__(self, ledger, key, owner):
+        self.ledger = ledger
+        self.key = key
+        self.owner = owner
+
+    def ready(self):
+        return not self.ledger.busy(self.key, self.owner)
+
+    def __repr__(self):
+        return "Wait(%r)" % (self.key,)
+
+
+### @export "class Engine"
+class Engine(object):
+    """
+    Drives the shell commands of many targets at once from one
+    thread.  Each Job's steps are a generator like Scribe.steps()
+    that yields shell lines; the Engine starts each line, polls
+    all of the output pipes, and resumes the generator when the
+    process exits.  Output goes out a whole line at a time so
+    targets don't garble each other, and cancel() kills everything
+    that's running.
+
+    Reference commands like py or cd run inside the generator, so
+    they block the loop while they run (and their own shell lines
+    run the normal way).  A needs for a target another Job is
+    running yields a Wait, and that Job sits out until it's done.
+    """
+
+    def __init__(self, jobs=0):
+        self.jobs = jobs
+        self.waiting = []
+        self.running = {}
+        self.parked = []
+        self.poll = select.poll()
+        self.fds = {}
+        self.cancelled = False
+
+    def add(self, scribe, steps, done):
+        """
+        Queues up steps to run for scribe.  done is called with None
+        when they're finished or the exception that stopped them.
+        """
+        self.waiting.append(Job(scribe, steps, done))
+
+    ### @export "the loop"
+    def run(self):
+        """Runs until every job is done or the engine is cancelled."""
+        try:
+            while self.waiting or self.running or self.parked:
+                self.unpark()
+                while self.waiting and not (self.jobs and len(self.running) >= self.jobs):
+                    self.advance(self.waiting.pop(0))
+
+                if not self.fds: continue
+                try:
+                    events = self.poll.poll()
+                except select.error, err:
+                    if err[0] == errno.EINTR: continue
+                    raise
+
+                for fd, event in events:
+                    if fd in self.fds: self.read(fd)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+
+    def advance(self, job):
+        """
+        Gets the next shell line from the job and starts it, going on
+        to the next one right away when running is skipped by a
+        dry run.  Finishes the job when its steps run out or fail.
+        """
+        scribe = job.scribe
+        try:
+            while not self.cancelled:
+                job.cmd = job.steps.next()
+                if isinstance(job.cmd, Wait):
+                    self.parked.append(job)
+                    return
+                formatted = scribe.interpolate("sh", job.cmd)
+                scribe.log(" sh: %r" % formatted)
+                if not scribe.option("dry_run"):
+                    self.start(job, formatted)
+                    return
+        except StopIteration:
+            pass
+        except Exception, err:
+            job.steps.close()
+            job.done(err)
+            return
+
+        if self.cancelled:
+            job.steps.close()
+        job.done(None)
+
+    def unpark(self):
+        """
+        Queues up the parked Jobs whose Wait is over, ahead of the
+        new ones.  If nothing else is left to run then they're
+        waiting on each other and they all fail.
+        """
+        ready = [job for job in self.parked if job.cmd.ready()]
+        if not (ready or self.waiting or self.running):
+            ready = self.parked
+            for job in ready:
+                job.steps.close()
+                job.done(DieError(job.scribe.target, job.scribe.line, job.cmd,
+                                  "targets in the async build are waiting on each other"))
+            self.parked = []
+            return
+
+        for job in ready:
+            self.parked.remove(job)
+        self.waiting[0:0] = ready
+
+    def start(self, job, formatted):
+        """Starts the process for a line, watching its output pipes."""
+        argv = job.scribe.option("direct") and plain_argv(formatted)
+        try:
+            # each line gets its own process group so cancel() can kill
+            # everything it started, not just the shell
+            job.proc = subprocess.Popen(argv or formatted, shell=not argv,
+                                        stdout=subprocess.PIPE, 
+                                        stderr=subprocess.PIPE, close_fds=True,
+                                        preexec_fn=os.setpgrp)
+        except OSError:
+            job.proc = subprocess.Popen("exit 127", shell=True)
+
+        self.running[job.proc.pid] = job
+        for pipe, out in [(job.proc.stdout, sys.stdout), (job.proc.stderr, sys.stderr)]:
+            if pipe is None: continue
+            job.pipes[pipe.fileno()] = [pipe, out, ""]
+            self.fds[pipe.fileno()] = job
+            self.poll.register(pipe.fileno(), select.POLLIN | select.POLLHUP)
+
+        if not job.pipes: self.exited(job)
+
+    ### @export "output and exits"
+    def read(self, fd):
+        """Reads what's there on fd and writes out any whole lines."""
+        job = self.fds[fd]
+        pipe, out, partial = job.pipes[fd]
+        data = os.read(fd, 65536)
+        if data:
+            lines = (partial + data).split("\n")
+            job.pipes[fd][2] = lines.pop()
+            if lines:
+                out.write("\n".join(lines) + "\n")
+                out.flush()
+        else:
+            if partial:
+                out.write(partial)
+                out.flush()
+            self.poll.unregister(fd)
+            del self.fds[fd]
+            del job.pipes[fd]
+            pipe.close()
+            if not job.pipes: self.exited(job)
+
+    def exited(self, job):
+        """
+        Collects the exit status once the output is all read, dying
+        like sh does on failure, and moves the job along.
+        """
+        retcode = job.proc.wait()
+        del self.running[job.proc.pid]
+        job.proc = None
+        job.scribe.invalidate()
+        if retcode != 0 and not self.cancelled:
+            try:
+                job.scribe.die(job.cmd)
+            except DieError, err:
+                job.steps.close()
+                job.done(err)
+                return
+        self.advance(job)
+
+    def cancel(self):
+        """Stops starting new lines and kills the running ones."""
+        self.cancelled = True
+        for job in self.running.values():
+            try:
+                os.killpg(job.proc.pid, signal.SIGTERM)
+            except OSError:
+                pass
@@ -0,0 +1,169 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from vellum.store import Store
+import fnmatch
+import glob
+import os
+import re
+import time
+
+# directories forall never walks into unless the pattern names them
+IGNORE = [".git", ".bzr", ".svn", ".hg", "build", "dist", "*.egg-info", ".vellum"]
+
+### @export "class FileIndex"
+class FileIndex(object):
+    """
+    Remembers what is in each directory forall walks, in the
+    project's .vellum/files, along with the directory's mtime.
+    Adding, removing, or renaming a file changes the mtime of the
+    directory it's in, so a directory whose mtime hasn't moved is
+    taken from the index instead of being listed again, and a
+    whole tree that hasn't changed costs one stat per directory.
+
+    Directories matching IGNORE (or the ignore patterns given) are
+    skipped, and when the pattern starts with plain directories
+    like "./src/vellum/*.py" only that part of the tree is walked.
+    The files returned are the same, in the same order, as a full
+    os.walk of top would have matched.
+    """
+
+    def __init__(self, stats, store=None):
+        self.stats = stats
+        self.store = store or Store("files")
+        self.matched = {}
+
+    def files(self, top, pattern, ignore=IGNORE):
+        """Lists the files under top whose path matches the pattern."""
+        key = (top, pattern, tuple(ignore))
+        if key in self.matched:
+            checks, matches = self.matched[key]
+            if [d for d, mtime in checks if self.mtime(d) != mtime] == []:
+                return matches
+
+        checks = []
+        matches = []
+        for path, fnames in self.walk(start(top, pattern), ignore, checks):
+            paths = [os.path.join(path, f) for f in fnames]
+            matches.extend(fnmatch.filter(paths, pattern))
+        self.matched[key] = (checks, matches)
+        return matches
+
+    def walk(self, top, ignore, checks):
+        """
+        Yields each directory under top with its files, walking in
+        the same order os.walk does and recording the (dir, mtime)
+        of each one in checks.
+        """
+        entry = self.entry(top)
+        checks.append((top, entry and entry[0]))
+        if not entry: return
+        mtime, dirs, fnames = entry
+        yield top, fnames
+        for name in dirs:
+            if not ignored(name, ignore):
+                for found in self.walk(os.path.join(top, name), ignore, checks):
+                    yield found
+
+    ### @export "the index"
+    def mtime(self, dir):
+        st = self.stats.stat(dir)
+        return st and st.st_mtime
+
+    def entry(self, dir):
+        """
+        Returns (mtime, dirs, files) for dir, from the index if its
+        mtime is the same, or None if it isn't a directory.  The
+        mtime is None when it's too recent to trust.  The
+        dirs are only the ones to walk into, so like os.walk links
+        to directories aren't followed.
+        """
+        if not self.stats.isdir(dir): return None
+        key = self.stats.key(dir)
+        mtime = self.mtime(dir)
+        entry = self.store.get(key)
+        if entry and entry[0] == mtime:
+            return entry
+
+        try:
+            names = os.listdir(dir)
+        except OSError:
+            return None
+        self.stats.listed(dir, names)
+        dirs, fnames = [], []
+        for name in names:
+            path = os.path.join(dir, name)
+            if self.stats.isdir(path):
+                if not os.path.islink(path): dirs.append(name)
+            else:
+                fnames.append(name)
+
+        # a change in the same tick as the mtime can't be seen, so
+        # a directory that was just touched is listed again next time
+        entry = (mtime if time.time() - mtime > 1 else None, dirs, fnames)
+        self.store[key] = entry
+        return entry
+
+    def save(self):
+        self.store.save()
+
+### @export "streaming"
+class Matches(object):
+    """
+    The files a streaming forall matches.  Iterating it walks the
+    tree again, and it only turns into a list when it's printed,
+    so no matter how many files there are it stays small.
+    """
+
+    def __init__(self, top, pattern, ignore=IGNORE):
+        self.top = top
+        self.pattern = pattern
+        self.ignore = ignore
+
+    def __iter__(self):
+        return walk(self.top, self.pattern, self.ignore)
+
+    def __len__(self):
+        return sum([1 for path in self])
+
+    def __contains__(self, path):
+        return path in iter(self)
+
+    def __str__(self):
+        return str(list(self))
+
+    def __repr__(self):
+        return repr(list(self))
+
+def walk(top, pattern, ignore=IGNORE):
+    """
+    Yields the files under top matching pattern as the walk finds
+    them, keeping nothing (not even in the index) once it's past.
+    """
+    match = re.compile(fnmatch.translate(os.path.normcase(pattern))).match
+    for path, dirs, fnames in os.walk(start(top, pattern)):
+        dirs[:] = [name for name in dirs if not ignored(name, ignore)]
+        for name in fnames:
+            file = os.path.join(path, name)
+            if match(os.path.normcase(file)): yield file
+
+def ignored(name, ignore):
+    return [p for p in ignore if fnmatch.fnmatch(name, p)] != []
+
+def start(top, pattern):
+    """
+    Where to start walking for a pattern: the deepest directory
+    under top that the start of the pattern names without any
+    wildcards, or top itself.  It has to be a path os.walk(top)
+    would have gone through, so ".", "..", and links are left to
+    the full walk.
+    """
+    prefix = top.rstrip(os.sep) + os.sep
+    if not pattern.startswith(prefix): return top
+
+    dir = top
+    for part in pattern[len(prefix):].split(os.sep)[:-1]:
+        if glob.has_magic(part) or part in ("", ".", ".."): break
+        path = os.path.join(dir, part)
+        if os.path.islink(path): break
+        dir = path
+    return dir
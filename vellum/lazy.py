@@ -0,0 +1,178 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from __future__ import with_statement
+import ast
+import imp
+import os
+import sys
+
+### @export "class Command"
+class Command(object):
+    """
+    Stands in for a command from a module that hasn't been imported
+    yet.  It knows the module, the name, and the docstring from the
+    index, so -C and -S can show it, and the module only gets
+    imported the first time the command is actually called.
+    """
+
+    def __init__(self, module, name, doc=None, source=None):
+        self.module = module
+        self.name = name
+        self.__doc__ = doc
+        self.source = source
+        self.func = None
+
+    def resolve(self):
+        """Imports the module if needed and returns the real command."""
+        if self.func is None:
+            if self.source: sys.path.append(self.source)
+            try:
+                mod = __import__(self.module, globals(), locals(), [self.name])
+            finally:
+                if self.source: sys.path.pop()
+            self.func = getattr(mod, self.name)
+        return self.func
+
+    def __call__(self, *args, **kw):
+        return self.resolve()(*args, **kw)
+
+    def __repr__(self):
+        return "Command(%r,%r)" % (self.module, self.name)
+
+### @export "indexing modules"
+def find_source(name, path):
+    """
+    Finds the .py file for a dotted module name the way import would,
+    but without importing anything.  Returns None if the module isn't
+    a plain source file, so the caller can just import it instead.
+    """
+    source = None
+    for part in name.split("."):
+        try:
+            f, file, (suffix, mode, kind) = imp.find_module(part, path)
+        except Exception:
+            return None
+        if f: f.close()
+
+        if kind == imp.PKG_DIRECTORY:
+            path = [file]
+            source = os.path.join(file, "__init__.py")
+        elif kind == imp.PY_SOURCE:
+            path = []
+            source = file
+        else:
+            return None
+
+    return source if os.path.exists(source) else None
+
+# values that can't be a command, whatever names they use
+PLAIN = (ast.Num, ast.Str, ast.List, ast.Tuple, ast.Dict, ast.Set,
+         ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp,
+         ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.Repr)
+
+def scan_source(file, path, seen=()):
+    """
+    Works out what each top level name in a module's source is bound
+    to without running it.  Returns a dict that maps each name to
+    a (module, name, doc) tuple if it's callable, False if it isn't,
+    or None if there's no telling, plus a flag that's True when the
+    module binds names in ways this can't follow.  The module in the
+    tuple is None for things the file defines itself, otherwise it's
+    the module a "from X import name" really got it from.  Returns
+    None if the source won't parse.
+    """
+    try:
+        with open(file) as f:
+            tree = ast.parse(f.read(), file)
+    except (SyntaxError, IOError):
+        return None
+
+    seen = set(seen) | set([file])
+    names = {}
+    opaque = False
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names[node.name] = (None, node.name,
+                                ast.get_docstring(node, clean=False))
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                names[alias.asname or alias.name.split(".")[0]] = False
+        elif isinstance(node, ast.ImportFrom):
+            if node.module == "__future__": continue
+            opaque = scan_import(node, path, seen, names) or opaque
+        elif isinstance(node, ast.Assign):
+            value = node.value
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    if isinstance(value, ast.Lambda):
+                        names[target.id] = (None, target.id, None)
+                    elif isinstance(value, ast.Name):
+                        names[target.id] = names.get(value.id,
+                                False if value.id in ("None", "True", "False") else None)
+                    else:
+                        names[target.id] = False if isinstance(value, PLAIN) else None
+                elif isinstance(target, (ast.Tuple, ast.List)):
+                    for elt in target.elts:
+                        if isinstance(elt, ast.Name): names[elt.id] = None
+        elif isinstance(node, ast.AugAssign):
+            if isinstance(node.target, ast.Name) and names.get(node.target.id) is not False:
+                names[node.target.id] = None
+        elif isinstance(node, ast.Delete):
+            for target in node.targets:
+                if isinstance(target, ast.Name): names.pop(target.id, None)
+        elif isinstance(node, ast.If) and is_main(node.test):
+            continue
+        elif not isinstance(node, (ast.Expr, ast.Pass, ast.Print, ast.Assert)):
+            opaque = True
+
+    return names, opaque
+
+def scan_import(node, path, seen, names):
+    """
+    Binds the names a "from X import name" brings in, following X's
+    source when it can.  Returns True if it was a * import.
+    """
+    source = not node.level and find_source(node.module, path)
+    found = source and source not in seen and scan_source(source, path, seen)
+    theirs = found[0] if found else {}
+
+    for alias in node.names:
+        if alias.name == "*": return True
+
+        bound = alias.asname or alias.name
+        entry = theirs.get(alias.name)
+        if entry:
+            names[bound] = (entry[0] or node.module, entry[1], entry[2])
+        elif entry is False or (source and
+                find_source(node.module + "." + alias.name, path)):
+            names[bound] = False
+        else:
+            names[bound] = None
+
+    return False
+
+def is_main(test):
+    """Spots the if __name__ == "__main__": at the end of a script."""
+    return (isinstance(test, ast.Compare) and
+            isinstance(test.left, ast.Name) and test.left.id == "__name__")
+
+def index_source(file, path=None):
+    """
+    Reads the public commands out of a module's source, including the
+    ones it assigns from lambdas or imports with "from X import name",
+    and returns a dict that maps their names to (module, name, doc).
+    Returns None if the source won't parse, or if there's any public
+    name it can't be sure about, so the caller imports it instead and
+    gets the same commands Press.import_module would.
+    """
+    scanned = scan_source(file, sys.path if path is None else path)
+    if scanned is None: return None
+
+    names, opaque = scanned
+    public = dict([(name, entry) for name, entry in names.items()
+                   if not name.startswith("_")])
+    if opaque or None in public.values():
+        return None
+
+    return dict([(name, entry) for name, entry in public.items() if entry])
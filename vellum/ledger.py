@@ -0,0 +1,68 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from __future__ import with_statement
+import threading
+
+class Ledger(object):
+    """
+    Records which targets a Scribe has finished so that each one
+    only runs once, even when it's reached through both depends
+    and needs, or by two workers at once in a parallel build.
+
+    Each entry keeps a fingerprint of the files its target declared.
+    When the same Scribe builds again (like in the vellum shell)
+    begin() keeps the entries whose files haven't changed and
+    drops the rest, including any that declared no files at all.
+    """
+
+    def __init__(self):
+        self.done = {}
+        self.running = {}
+        self.lock = threading.Condition()
+
+    def begin(self, fingerprint):
+        """
+        Starts a new build.  The fingerprint function is called
+        with each key and must return the same thing it did when
+        the key was finished for the entry to be kept.
+        """
+        with self.lock:
+            for key, prints in self.done.items():
+                if not prints or fingerprint(key) != prints:
+                    del self.done[key]
+
+    def claim(self, key, owner=None):
+        """
+        Returns True if the owner should run key.  If another owner
+        is running it this waits for that to finish first, and if
+        this owner is already running it (a target that needs itself)
+        this just says no.  The owner is whatever runs targets one
+        at a time, a Scribe or by default the calling thread.
+        """
+        owner = owner or threading.currentThread()
+        with self.lock:
+            while key in self.running:
+                if self.running[key] is owner: return False
+                self.lock.wait()
+            if key in self.done: return False
+            self.running[key] = owner
+            return True
+
+    def busy(self, key, owner=None):
+        """Tells if an owner other than this one is running key."""
+        owner = owner or threading.currentThread()
+        with self.lock:
+            return self.running.get(key, owner) is not owner
+
+    def finish(self, key, fingerprint=None, done=True):
+        """
+        Records that key finished.  Failed keys (done=False) are
+        forgotten so they're tried again.
+        """
+        with self.lock:
+            del self.running[key]
+            if done: self.done[key] = fingerprint
+            self.lock.notifyAll()
+
+    def __contains__(self, key):
+        return key in self.done
@@ -0,0 +1,115 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from __future__ import with_statement
+from vellum.store import Store
+from vellum.template import references
+import hashlib
+
+### @export "class Manifest"
+class Manifest(object):
+    """
+    Remembers, in the project's .vellum/manifests, the files each
+    forall with 'changed 1' last ran its do block on successfully,
+    as (mtime, size, digest) with the digest only kept when asked
+    for.  A forall is known by its target, top, pattern, and var,
+    and a change to its do block, or to an option the block uses,
+    starts it over with every file.
+    """
+
+    def __init__(self, stats, store=None):
+        self.stats = stats
+        self.store = store or Store("manifests")
+
+    def load(self, key, body, options={}):
+        """
+        The files recorded for key, or none if body or the options
+        it references have changed.
+        """
+        signature, prints = self.store.get(key, (None, {}))
+        return prints if signature == self.signature(body, options) else {}
+
+    def record(self, key, body, prints, options={}):
+        self.store[key] = (self.signature(body, options), prints)
+
+    def signature(self, body, options={}):
+        used = [(name, options.get(name)) for name in sorted(references(body))]
+        return hashlib.md5(repr((body, used))).hexdigest()
+
+    ### @export "fingerprints"
+    def fingerprint(self, path, digest=False, old=None):
+        """
+        Returns (mtime, size, digest) for path, or None if it's gone.
+        The file is only read for the digest when the stat differs
+        from old, since the same stat means the same contents.
+        """
+        st = self.stats.stat(path)
+        if not st: return None
+        if old and old[:2] == (st.st_mtime, st.st_size):
+            return old
+        if not digest:
+            return (st.st_mtime, st.st_size, None)
+        try:
+            with open(path, "rb") as f:
+                return (st.st_mtime, st.st_size, hashlib.sha1(f.read()).hexdigest())
+        except IOError:
+            return None
+
+    def unchanged(self, old, new):
+        """Tells if new is the same file as old, by stat or by digest."""
+        if not (old and new): return False
+        return old[:2] == new[:2] or (new[2] is not None and old[2] == new[2])
+
+    def save(self):
+        self.store.save()
+
+### @export "class Changes"
+class Changes(object):
+    """
+    One forall's pass over its files against a Manifest.  Iterating
+    it gives only the files that are new or changed since they last
+    ran, done() is told which of those worked, and record() writes
+    the manifest back.  A file that fails is left out, so it runs
+    again next time, and one that's gone is dropped once a pass
+    gets through all the files.
+    """
+
+    def __init__(self, manifest, key, body, files, digest=False, force=False,
+                 options={}):
+        self.manifest = manifest
+        self.key = key
+        self.body = body
+        self.options = options
+        self.files = files
+        self.digest = digest
+        self.force = force
+        self.old = manifest.load(key, body, options)
+        self.prints = dict(self.old)
+        self.pending = {}
+        self.seen = set()
+        self.complete = False
+        self.count = 0
+
+    def __iter__(self):
+        for file in self.files:
+            old = self.old.get(file)
+            new = self.manifest.fingerprint(file, self.digest, old)
+            self.seen.add(file)
+            if not self.force and self.manifest.unchanged(old, new):
+                self.prints[file] = new
+                continue
+
+            self.prints.pop(file, None)
+            self.pending[file] = new
+            self.count += 1
+            yield file
+        self.complete = True
+
+    def done(self, file, ok):
+        new = self.pending.pop(file, None)
+        if ok and new: self.prints[file] = new
+
+    def record(self):
+        if self.complete:
+            for file in [f for f in self.prints if f not in self.seen]:
+                del self.prints[file]
+        self.manifest.record(self.key, self.body, self.prints, self.options)
@@ -1,10 +1,20 @@
 # Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
 
+from vellum.scanner import TokenScanner, unquote
+
 class Reference(object):
+    __slots__ = ("name", "expr")
+
     def __init__(self,name, expr):
-        self.name = name
+        self.name = intern(name)
         self.expr = expr
 
+    def __getstate__(self):
+        return (self.name, self.expr)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
     def __str__(self):
         if self.expr:
             return "%s(%r)" % (self.name, self.expr)
@@ -48,7 +58,7 @@ parser Parser:
 
     rule atom: 
         NUMBER {{ return atoi(NUMBER) }} 
-        | STRING {{ return eval(STRING) }}
+        | STRING {{ return unquote(STRING) }}
         | SH LINE {{ return LINE }}
 
     rule structure: 
@@ -63,6 +73,16 @@ parser Parser:
 ### @end
 
 ### @export "footer"
+def parse_tokens(rule, text):
+    """
+    Parses with the single pass TokenScanner instead of the
+    generated ParserScanner, which parse() still uses so the two
+    can be compared.  This has its own name so it doesn't replace
+    the parse() that gets generated above it.
+    """
+    P = Parser(TokenScanner(text))
+    return wrap_error_reporter(P, rule)
+
 if __name__ == '__main__':
     from sys import argv, stdin
     if len(argv) >= 2:
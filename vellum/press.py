@@ -2,13 +2,66 @@
 
 from __future__ import with_statement
 from vellum import ImportError
+from vellum.store import Store
+from vellum.scanner import TokenScanner, stanzas
+from vellum.lazy import Command, find_source, index_source
+from vellum.stats import StatCache
 import vellum.parser
+import cPickle as pickle
+import hashlib
 import os
 import sys
 from pprint import pprint
+from Queue import Queue
+import threading
 
 class LoadError(ImportError): pass
 
+# stanzas that hold build structure rather than user data, so
+# their lists can be frozen into tuples
+FROZEN = ["targets", "depends", "inputs", "outputs"]
+
+# the dict style stanzas that join() merges into main
+JOINED = ["targets", "options", "depends", "inputs", "outputs"]
+
+# how many recipes prefetch() reads and parses at once
+PREFETCH_JOBS = 8
+
+# bumped whenever the format of the index in .vellum/commands changes
+INDEX_VERSION = 2
+
+### @export "compacting specs"
+def freeze(value):
+    """
+    Makes a parsed value smaller and immutable: strings are interned
+    so every copy of a name or command line is shared, lists become
+    tuples, and References are rebuilt with frozen expressions.
+    Dicts stay dicts since commands take them as keyword args.
+    """
+    if isinstance(value, str):
+        return intern(value)
+    elif isinstance(value, (list, tuple)):
+        return tuple([freeze(v) for v in value])
+    elif isinstance(value, dict):
+        return dict([(freeze(k), freeze(v)) for k, v in value.items()])
+    elif isinstance(value, vellum.parser.Reference):
+        return vellum.parser.Reference(value.name, freeze(value.expr))
+    else:
+        return value
+
+def compact(spec):
+    """
+    Interns the keys of every stanza and freezes the stanzas that
+    are build structure.  Options keep their values as they are.
+    """
+    for section, stanza in spec.items():
+        if not isinstance(stanza, dict): continue
+        if section in FROZEN:
+            spec[section] = freeze(stanza)
+        else:
+            spec[section] = dict([(freeze(k), v) for k, v in stanza.items()])
+    return spec
+
 ### @export "class Press"
 class Press(object):
     """
@@ -26,15 +79,24 @@ class Press(object):
         defaults (which come from vellum.bin.parse_sys_argv().
         """
         self.options = defaults
+        self.stats = StatCache()
         self.module_source = os.path.expanduser("~/.vellum/modules")
         self.recipe_source =  os.path.expanduser("~/.vellum/recipes")
         self.recipes = {}
         self.modules = {}
+        self.texts = {}
+        self.prefetched = {}
+        self.sources = {main + ".vel": (None, None)}
+        self.parsed = Store("recipes", os.path.join(os.path.dirname(main), ".vellum"))
+        self.indexed = Store("commands", os.path.join(os.path.dirname(main), ".vellum"))
         self.main = self.load_recipe(main + ".vel")
         self.main["commands"] = {}
         # we always need these commands
         self.load('module', 'vellum.commands')
+        self.prefetch(self.main)
         self.imports(self.main)
+        self.parsed.save()
+        self.indexed.save()
 
     ### @export "resolve_vel_file"
     def resolve_vel_file(self, name):
@@ -49,7 +111,7 @@ class Press(object):
             name += ".vel"
 
         names = (os.path.join(n, name) for n in ["./", self.recipe_source])
-        found = [n for n in names if os.path.exists(n)]
+        found = [n for n in names if self.stats.exists(n)]
         if len(found) == 1:
             return found[0]
         elif len(found) > 1:
@@ -70,6 +132,7 @@ class Press(object):
             file = self.resolve_vel_file(file)
             if file not in self.recipes:
                 spec = self.load_recipe(file)
+                self.sources[file] = (file, as_name)
                 self.join(spec, self.main, file, as_name)
                 self.imports(spec)
         elif kind == "module":
@@ -92,23 +155,171 @@ class Press(object):
         """
         if file in self.recipes:
             return self.recipes[file]
+        elif file in self.prefetched:
+            return self.prefetched.pop(file)
         else:
-            with open(file) as f:
-                spec = vellum.parser.parse('input', f.read() + '\0')
-                if not spec:
-                    raise ImportError("Parser error in file: %s" % file)
+            return self.parse_recipe(file)
+
+    ### @export "parse cache"
+    def parse_recipe(self, file, quiet=False):
+        """
+        Parses a recipe, reusing the spec pickled into .vellum/recipes
+        the last time it was parsed if the file's mtime and size are
+        the same, or failing that if its contents hash the same.
+        The text is kept so refresh() can tell what changed later.
+        When quiet a syntax error is raised instead of printed.
+        """
+        key = os.path.abspath(file)
+        st = os.stat(file)
+        stamp = (st.st_mtime, st.st_size)
+        with open(file) as f:
+            text = f.read()
+        self.texts[file] = text
+
+        cached = self.parsed.get(key)
+        if cached and cached[0] == stamp:
+            return pickle.loads(cached[2])
+
+        digest = hashlib.md5(text).digest()
+        if cached and cached[1] == digest:
+            self.parsed[key] = (stamp, digest, cached[2])
+            return pickle.loads(cached[2])
+
+        if quiet:
+            spec = vellum.parser.Parser(TokenScanner(text + '\0')).input()
+        else:
+            spec = vellum.parser.parse_tokens('input', text + '\0')
+        if not spec:
+            raise ImportError("Parser error in file: %s" % file)
+        compact(spec)
+
+        self.parsed[key] = (stamp, digest, 
+                            pickle.dumps(spec, pickle.HIGHEST_PROTOCOL))
+        return spec
+
+    ### @export "prefetch"
+    def prefetch(self, spec, jobs=PREFETCH_JOBS):
+        """
+        Walks the tree of recipe imports under spec, reading and
+        parsing each recipe on a set of threads as soon as the recipe
+        importing it is parsed.  The specs are only kept for
+        load_recipe(), so imports() still joins them one at a time
+        in the same order as always.  Recipes that fail are left for
+        load() to fail on so the error comes out the same way.
+
+        This uses plain threads rather than a ThreadPool because the
+        pool's handler threads take up to 100ms to notice a join().
+        They're all joined before it returns, so none are still
+        running when the interpreter shuts down.
+        """
+        seen = set()
+        queued = self.recipe_imports(spec, seen)
+        if not queued: return
+
+        todo, done = Queue(), Queue()
+        def worker():
+            for file in iter(todo.get, None):
+                done.put(self.prefetch_recipe(file))
+
+        workers = [threading.Thread(target=worker)
+                   for i in range(min(jobs, len(queued)))]
+        for thread in workers:
+            thread.start()
+
+        pending = 0
+        try:
+            while queued or pending:
+                for file in queued:
+                    todo.put(file)
+                pending += len(queued)
+
+                file, parsed = done.get()
+                pending -= 1
+                if parsed:
+                    self.prefetched[file] = parsed
+                    queued = self.recipe_imports(parsed, seen)
                 else:
-                    return spec
+                    queued = []
+        finally:
+            # joined so none are left running when vellum exits
+            for thread in workers:
+                todo.put(None)
+            for thread in workers:
+                thread.join()
+
+    def prefetch_recipe(self, file):
+        """
+        Parses one recipe for prefetch(), giving None if it fails.
+        It's parsed quietly so load() is the only one to print
+        what's wrong with it.
+        """
+        try:
+            return file, self.parse_recipe(file, quiet=True)
+        except Exception:
+            return file, None
+
+    def recipe_imports(self, spec, seen):
+        """
+        Lists the files of the recipe(...) imports in spec that aren't
+        in seen yet, and adds them to it.
+        """
+        files = []
+        for imp in spec.get("imports", []):
+            if imp.name != "recipe" or not isinstance(imp.expr, dict): continue
+            try:
+                file = self.resolve_vel_file(imp.expr.get("from", ""))
+            except ImportError:
+                continue
+            if file not in seen:
+                seen.add(file)
+                files.append(file)
+        return files
 
     ### @export "load_module"
     def load_module(self, name):
         """
-        Loads a python module and extracts all of the 
-        methods that are usable as Vellum commands.
-        It returns a dict with the commands.
+        Finds the commands in a python module without importing
+        it, using the index of its source, and returns a dict of
+        lazy Commands that import it when they're first called.
+        Modules that can't be indexed get imported right away.
         """
         if name in self.modules: return self.modules[name]
 
+        index = self.index_module(name)
+        if index is None:
+            return self.import_module(name)
+        else:
+            return dict([(k, Command(module or name, attr, doc, self.module_source))
+                         for k, (module, attr, doc) in index.items()])
+
+    def index_module(self, name):
+        """
+        Gives the index of a module's commands from .vellum/commands,
+        reading its source again only if the file moved or its mtime
+        or size changed.  The commands it imports from elsewhere are
+        indexed as of when its own file last changed.
+        """
+        path = sys.path + [self.module_source]
+        file = find_source(name, path)
+        if not file: return None
+
+        st = os.stat(file)
+        stamp = (INDEX_VERSION, file, st.st_mtime, st.st_size)
+        cached = self.indexed.get(name)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        index = index_source(file, path)
+        if index is not None:
+            self.indexed[name] = (stamp, index)
+        return index
+
+    def import_module(self, name):
+        """
+        Imports a python module and extracts all of the 
+        methods that are usable as Vellum commands.
+        It returns a dict with the commands.
+        """
         sys.path.append(self.module_source)
         mod = __import__(name, globals(), locals())
 
@@ -130,7 +341,7 @@ class Press(object):
     def scope_name(self, key, name=None, as_name=None):
         """Does the common name scopings used."""
         name = as_name if as_name else name
-        return "%s.%s" % (name, key) if name else key
+        return intern("%s.%s" % (name, key)) if name else key
 
 
     ### @export "merge"
@@ -151,11 +362,80 @@ class Press(object):
         of the stanzas.
         """
         # first merge the common dict style stanzas
-        for section in ["targets", "options", "depends"]:
+        for section in ["targets", "options", "depends", 
+                        "inputs", "outputs"]:
             if section in source:
                 target.setdefault(section, {})
                 self.merge(source[section], 
                            target[section], named, as_name)
+    ### @export "refresh"
+    def refresh(self):
+        """
+        Re-reads every recipe this press loaded and splices just the
+        stanza entries whose text changed into self.main, so nothing
+        else gets parsed again.  Returns a list of the (section, name)
+        entries that changed, or None if something besides a dict
+        stanza's entries changed (like the imports) and the whole
+        press has to be built again.
+        """
+        changed = []
+        for file, (named, as_name) in self.sources.items():
+            with open(file) as f:
+                text = f.read()
+            if text == self.texts[file]: continue
+
+            spliced = self.splice(file, self.texts[file], text, named, as_name)
+            if spliced is None: return None
+            changed.extend(spliced)
+            self.texts[file] = text
+        return changed
+
+    def splice(self, file, old, new, named=None, as_name=None):
+        """
+        Compares the stanza spans of the old and new text of a
+        recipe, parses each changed entry by itself, and puts it
+        into self.main where join() would have.
+        """
+        before, after = stanzas(old + '\0'), stanzas(new + '\0')
+        if before is None or after is None: return None
+
+        def text(source, spans, name):
+            return source[slice(*spans[name])] if name in spans else None
+
+        def entries(found, name):
+            return found[name][1] if name in found else {}
+
+        # anything that isn't a dict stanza's entries needs a reload
+        old_spans = dict((name, span) for name, (span, e) in before.items())
+        new_spans = dict((name, span) for name, (span, e) in after.items())
+        for name in set(before) | set(after):
+            if name in JOINED:
+                if entries(before, name) is None or entries(after, name) is None:
+                    return None
+            elif text(old, old_spans, name) != text(new, new_spans, name):
+                return None
+
+        changed = []
+        for section in JOINED:
+            old_entries, new_entries = entries(before, section), entries(after, section)
+            target = self.main.setdefault(section, {})
+
+            for key in set(old_entries) | set(new_entries):
+                entry = text(new, new_entries, key)
+                if text(old, old_entries, key) == entry: continue
+
+                name = self.scope_name(key, named, as_name)
+                if entry is None:
+                    target.pop(name, None)
+                else:
+                    ref = vellum.parser.parse_tokens('reference', entry + '\0')
+                    if not ref:
+                        raise ImportError("Parser error in file: %s" % file)
+                    spec = compact({section: {ref.name: ref.expr}})
+                    target[name] = spec[section][ref.name]
+                changed.append((section, name))
+        return changed
+
     ### @export "imports"
     def imports(self, import_from):
         """
@@ -0,0 +1,151 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from zapps.rt import Scanner, SyntaxError
+import re
+
+# every token but LINE starts with a different character, so one
+# alternation finds them all; the group name is the token type
+TOKENS = re.compile(r"""
+    (?P<NUMBER>[0-9]+[0-9\.]*)
+  | (?P<STRING>'([^\n'\\]|\\.)*'|"([^\n"\\]|\\.)*")
+  | (?P<NAME>[a-zA-Z][a-zA-Z\-_0-9/\.]+)
+  | (?P<LPAR>\()
+  | (?P<RPAR>\))
+  | (?P<LSQB>\[)
+  | (?P<RSQB>\])
+  | (?P<ENDMARKER>\x00)
+  | (?P<SH>[>$|])
+  | (?P<COMMENT>\#)
+""", re.VERBOSE)
+
+IGNORE = re.compile(r"[\r\n \t]*")
+LINE = re.compile(r"[^\n\r]+\n")
+
+def unquote(text):
+    """Decodes a STRING token the way eval() would, without eval()."""
+    return text[1:-1].decode("string_escape")
+
+### @export "class TokenScanner"
+class TokenScanner(Scanner):
+    """
+    A drop in replacement for the generated ParserScanner that
+    tokenizes the whole input in one pass with a single combined
+    regex instead of trying each pattern at every position.
+
+    LINE is the only token that overlaps the others, and it only
+    ever comes after SH or COMMENT, so it's scanned right after
+    those the same way the restricted scanner would: whichever of
+    the whitespace or the line is longer wins.
+    """
+
+    def __init__(self, input):
+        Scanner.__init__(self, None, [], input)
+        self.tokens = []
+        self.error = None
+        self.tokenize(input)
+        self.restrictions = [None] * len(self.tokens)
+
+    def tokenize(self, input):
+        """Fills self.tokens, stopping at the end or the first bad spot."""
+        tokens = self.tokens
+        pos = 0
+        end = len(input)
+        while pos < end:
+            pos = IGNORE.match(input, pos).end()
+            match = TOKENS.match(input, pos)
+            if not match: break
+
+            kind = match.lastgroup
+            tokens.append((pos, match.end(), kind, match.group()))
+            pos = match.end()
+            if kind == "ENDMARKER": return
+
+            if kind in ("SH", "COMMENT"):
+                pos = self.line(input, pos)
+                if pos is None: return
+
+        self.error = pos
+
+    def line(self, input, pos):
+        """
+        Scans the LINE after SH or COMMENT, returning the position
+        after it or None if there isn't one.
+        """
+        while True:
+            space = IGNORE.match(input, pos).end() - pos
+            match = LINE.match(input, pos)
+            if match and match.end() - pos > space:
+                self.tokens.append((pos, match.end(), "LINE", match.group()))
+                return match.end()
+            elif space:
+                pos += space
+            else:
+                self.error = pos
+                return None
+
+    def token(self, i, restrict=None):
+        """Returns token i, or raises a SyntaxError where scanning stopped."""
+        if i < len(self.tokens):
+            self.restrictions[i] = restrict
+            self.pos = self.tokens[i][1]
+            return self.tokens[i]
+        self.pos = self.error
+        raise SyntaxError(self.error, "Bad Token")
+
+### @export "stanza spans"
+def skip(tokens, i):
+    """Returns the index of the token just past the expr starting at i."""
+    kind = tokens[i][2]
+    if kind == "NAME":
+        return skip(tokens, i + 1)
+    elif kind in ("SH", "COMMENT"):
+        return i + 2
+    elif kind in ("LPAR", "LSQB"):
+        depth = 0
+        while True:
+            kind = tokens[i][2]
+            if kind in ("LPAR", "LSQB"): depth += 1
+            elif kind in ("RPAR", "RSQB"): depth -= 1
+            elif kind in ("SH", "COMMENT"): i += 1
+            elif kind == "ENDMARKER": raise IndexError("unclosed structure")
+            i += 1
+            if depth == 0: return i
+    else:
+        return i + 1
+
+def stanzas(text):
+    """
+    Finds the byte spans of the top level stanzas in a recipe (which
+    has to end in \\0) without parsing it.  Returns a dict mapping each
+    stanza's name to (span, entries), where entries maps the names in
+    a (...) stanza to their own spans and is None for any other kind
+    of stanza.  Like the parser, a later stanza or entry with the same
+    name replaces an earlier one.  Returns None if the text doesn't
+    scan or isn't laid out like a recipe.
+    """
+    scanner = TokenScanner(text)
+    tokens = scanner.tokens
+    if scanner.error is not None: return None
+
+    found = {}
+    try:
+        i = 0
+        while tokens[i][2] != "ENDMARKER":
+            end = skip(tokens, i)
+            if tokens[i][2] == "NAME":
+                entries = None
+                if tokens[i + 1][2] == "LPAR":
+                    entries = {}
+                    j = i + 2
+                    while j < end - 1:
+                        if tokens[j][2] != "NAME": return None
+                        k = skip(tokens, j)
+                        entries[tokens[j][3]] = (tokens[j][0], tokens[k - 1][1])
+                        j = k
+                found[tokens[i][3]] = ((tokens[i][0], tokens[end - 1][1]), entries)
+            elif tokens[i][2] != "COMMENT":
+                return None
+            i = end
+    except IndexError:
+        return None
+    return found
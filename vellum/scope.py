@@ -0,0 +1,92 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from UserDict import DictMixin
+
+# stands in for a key deleted from a scope that a parent still has
+DELETED = object()
+
+### @export "class Scope"
+class Scope(DictMixin, object):
+    """
+    The options a command sees, as its own vars laid over the
+    scope (or plain dict) it was pushed on.  Pushing one is O(1)
+    no matter how many options there are, where copying the dict
+    made every forall file pay for all of them.
+
+    Reads go down through the parents, while writes and deletes
+    only ever change this scope's vars, so like the copies it
+    replaces nothing leaks back out when it's popped.  It works
+    anywhere the dict did: % interpolation, exec and eval
+    namespaces, and == against a dict.  copy() gives a flat dict.
+    """
+
+    def __init__(self, vars=None, parent=None):
+        self.vars = {} if vars is None else vars
+        self.parent = {} if parent is None else parent
+
+    def __getitem__(self, key):
+        scope = self
+        while type(scope) is Scope:
+            if key in scope.vars:
+                value = scope.vars[key]
+                if value is DELETED: raise KeyError(key)
+                return value
+            scope = scope.parent
+        return scope[key]
+
+    def __setitem__(self, key, value):
+        self.vars[key] = value
+
+    def __delitem__(self, key):
+        if key not in self: raise KeyError(key)
+        if key in self.parent:
+            self.vars[key] = DELETED
+        else:
+            del self.vars[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    ### @export "the whole scope"
+    def copy(self):
+        """Flattens the layers into one plain dict."""
+        layers = []
+        scope = self
+        while type(scope) is Scope:
+            layers.append(scope.vars)
+            scope = scope.parent
+        flat = dict(scope)
+        for vars in reversed(layers):
+            flat.update(vars)
+        for key in [k for k, v in flat.iteritems() if v is DELETED]:
+            del flat[key]
+        return flat
+
+    def keys(self):
+        return self.copy().keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.copy())
+
+    def __eq__(self, other):
+        if isinstance(other, Scope): other = other.copy()
+        return self.copy() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.copy())
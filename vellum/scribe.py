@@ -1,7 +1,22 @@
 # Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
 
+from __future__ import with_statement
 from vellum import DieError
 from vellum.parser import Reference
+from vellum.store import Store
+from vellum.index import FileIndex
+from vellum.manifest import Manifest
+from vellum.scope import Scope
+from vellum.template import template, references
+from vellum.cache import Cache, RemoteCache, CACHE_SIZE
+from vellum.ledger import Ledger
+from vellum.shell import Shell
+from vellum.engine import Engine, Wait
+from vellum.lazy import Command
+import Queue
+import difflib
+import glob
+import hashlib
 import os
 import sys
 
@@ -25,6 +40,31 @@ class Scribe(object):
         self.source = os.path.expanduser("~/.vellum/modules")
         self.stack = []
         self.commands = self.script.commands
+        self.stats = self.script.stats
+        self.errors = 0
+        self.output = None
+        self.signatures = Store("signatures")
+        self.files = FileIndex(self.stats)
+        self.manifests = Manifest(self.stats)
+        self.ledger = Ledger()
+        self.engine = None  # set on the async Engine's workers
+        self.shell = None
+        remote = self.option("remote_cache")
+        self.cache = Cache(max_size=self.option("cache_size") or CACHE_SIZE,
+                           remote=RemoteCache(remote) if remote else None)
+
+    def fork(self):
+        """
+        Makes a new Scribe for the same script so that a worker
+        thread gets its own target, line, and scope stack.
+        """
+        scribe = Scribe(self.script)
+        scribe.signatures = self.signatures
+        scribe.files = self.files
+        scribe.manifests = self.manifests
+        scribe.cache = self.cache
+        scribe.ledger = self.ledger
+        return scribe
 
     ### @export "support methods"
     def option(self, name):
@@ -37,14 +77,17 @@ class Scribe(object):
         option (not quiet).
         """
         if self.option("verbose"): 
-            print msg
-            sys.stdout.flush()
+            # one write so parallel targets don't split lines
+            out = self.output or sys.stdout
+            out.write("%s\n" % msg)
+            out.flush()
 
     def die(self, cmd, msg=""):
         """
         Dies with an error message for the given command listing 
         the target and line number in that target.
         """
+        self.errors += 1
         if not self.option("keep_going"):
             raise DieError(self.target, self.line, cmd, msg)
 
@@ -59,7 +102,7 @@ class Scribe(object):
         Takes the body of a target and figures out how to split it
         up so that you can execute it.
         """
-        if isinstance(cmds, list):
+        if isinstance(cmds, (list, tuple)):
             return cmds  # lists of stuff are just fine
         elif isinstance(cmds, Reference):
             return [cmds]  # gotta put single references into a list
@@ -77,6 +120,15 @@ class Scribe(object):
         return (target in self.script.targets 
                 and self.script.targets[target])
 
+    def persistent_shell(self):
+        """
+        Gets the Shell that the current target's lines run in when
+        the persistent option is on.  transition() closes it when
+        the target is done.
+        """
+        if not self.shell: self.shell = Shell()
+        return self.shell
+
     ### @export "handling commands"
     def is_command(self, name):
         """Tells the scribe if this name is an actual command."""
@@ -96,6 +148,10 @@ class Scribe(object):
         except KeyError, err:
             self.die(name, "Invalid command name %s, use -C to find out what's available.")
 
+        if isinstance(to_call, Command):
+            # imports it the first time, then skips the proxy
+            to_call = self.commands[name] = to_call.resolve()
+
         if isinstance(expr, dict):
             return to_call(self, **expr)
         else:
@@ -110,6 +166,17 @@ class Scribe(object):
         string (shell command(s)) or a Reference (do some command),
         or a list of those two.  Assumes you call self.start_target()
         """
+        for cmd in self.steps(body):
+            if not isinstance(cmd, Wait): self.command("sh", cmd)
+
+    def steps(self, body):
+        """
+        Does the work of execute() but yields the shell lines instead
+        of running them, so the async Engine can run them while
+        other targets go on.  Reference commands are run here, and
+        for the Engine a needs first yields a Wait for each target
+        another of its jobs is running.
+        """
         for cmd in self.parse_target(body):
             if "__builtins__" in self.options:
                 self.die(cmd, "Your command leaked __builtins__."
@@ -118,6 +185,8 @@ class Scribe(object):
 
             self.line += 1
             if isinstance(cmd, Reference):
+                if self.engine and cmd.name == "needs":
+                    for wait in self.waits(cmd.expr): yield wait
                 # Reference objects are indications to run some 
                 # Python command rather than a shell.
                 if self.is_command(cmd.name):
@@ -133,21 +202,218 @@ class Scribe(object):
             else:
                 # it's just shell
                 cmd = cmd.strip()
-                if cmd: self.command("sh", cmd)
+                if cmd: yield cmd
 
     ### @export "transition to target"
     def transition(self, target):
         """
         The main engine of the whole thing, it will transition to
-        the given target and then process it's commands listed.  It
-        properly figures out if this is a command reference or a
-        plain string to run as a shell.
+        the given target and then process it's commands listed.
+        The ledger makes sure a target only runs once per build
+        no matter if it's reached by depends, needs, or both.
+        """
+        for cmd in self.target_steps(target):
+            if not isinstance(cmd, Wait): self.command("sh", cmd)
+
+    def target_steps(self, target):
+        """
+        Does the work of transition() but yields the shell lines
+        like steps() does.
         """
         if not self.is_target(target): return
+        key = self.ledger_key(target)
+        if self.engine and self.ledger.busy(key, self):
+            # the Engine's thread can't block, and this wasn't a Wait
+            self.die(target, "%s is running in another async job" % target)
+            return
+        if not self.ledger.claim(key, self): return
+
+        state = (self.target, self.line, self.shell)
+        errors = self.errors
+        done = False
+        try:
+            self.shell = None
+            for cmd in self.process(target):
+                yield cmd
+            done = errors == self.errors
+        finally:
+            if self.shell: self.shell.close()
+            self.ledger.finish(key, self.fingerprint(target) if done else None, done)
+            self.target, self.line, self.shell = state
+
+    def process(self, target):
+        """
+        Yields the shell lines of a target, skipping it when it's up
+        to date or in the cache.  It properly figures out if this is
+        a command reference or a plain string to run as a shell,
+        and records the signature when it finishes without errors.
+        """
         self.line = 0
         self.target = target
+        if self.up_to_date(target):
+            self.log("<-- %s is up to date" % target)
+            return
+
+        # forget the old signature so a failure always rebuilds
+        tracked = target in self.script.outputs and not self.option("dry_run")
+        if tracked and target in self.signatures:
+            del self.signatures[target]
+
+        key = self.cache_key(target) if tracked else None
+        if key and self.cache.fetch(key, self.target_patterns(target, "outputs")):
+            self.log("<-- %s restored from the cache" % target)
+            self.signatures[target] = self.signature(target)
+            return
+
+        errors = self.errors
+        body = self.body_of_target(target)
+        for cmd in self.steps(body):
+            yield cmd
+
+        if tracked and errors == self.errors:
+            self.signatures[target] = self.signature(target)
+            if key: self.cache.store(key, self.target_files(target, "outputs"))
+
+    def waits(self, targets):
+        """Yields a Wait for each target another async job is running."""
+        for target in targets:
+            if not self.is_target(target): continue
+            key = self.ledger_key(target)
+            if self.ledger.busy(key, self):
+                yield Wait(self.ledger, key, self)
+
+    def invalidate(self):
+        """
+        Forgets cached stats after a command ran.  A target's outputs
+        stanza is its promise about what it writes, so when it has
+        one only those files are forgotten, otherwise everything is.
+        """
+        outputs = self.script.outputs.get(self.target) if self.target else None
+        if outputs:
+            self.stats.forget([self.interpolate("outputs", o) for o in outputs])
+        else:
+            self.stats.clear()
+
+    ### @export "the ledger"
+    def ledger_key(self, target):
+        """
+        Targets are run once per build, except inside a forall where
+        they run once for each file, so the key includes the value
+        of forall's current var.
+        """
+        var = self.option("var")
+        return (target, self.option(var) if var else None)
+
+    def fingerprint(self, target):
+        """
+        Stats the files a target declares so the ledger can tell
+        when a change means it should run again.  The signature of
+        its body goes in too, so editing it runs it again even when
+        the files are the same.  Targets without files give ().
+        """
+        prints = []
+        files = self.target_files(target, "inputs") + self.target_files(target, "outputs")
+        self.stats.prime(files)
+        for name in files:
+            st = self.stats.stat(name)
+            if st:
+                prints.append((name, st.st_mtime, st.st_size))
+            else:
+                prints.append((name, None, None))
+        return prints and (self.signature(target),) + tuple(prints) or ()
+
+    def refingerprint(self, key):
+        """
+        Fingerprints a ledger key again for the next build.  Keys
+        from inside a forall were fingerprinted in its scope, which
+        is gone now, so they give None and are always run again,
+        as do targets that aren't in the script anymore.
+        """
+        target, value = key
+        if value is not None or target not in self.script.targets: return None
+        return self.fingerprint(target)
+
+    ### @export "up to date checks"
+    def target_files(self, target, kind):
+        """
+        Returns the files a target lists in the inputs or outputs
+        stanza (kind), interpolated and with globs expanded.  Paths
+        that don't match anything are kept so missing outputs
+        are noticed.
+        """
+        files = []
+        for pattern in self.target_patterns(target, kind):
+            files.extend(sorted(glob.glob(pattern)) or [pattern])
+        return files
+
+    def target_patterns(self, target, kind):
+        """The interpolated inputs or outputs of a target, not globbed."""
+        return [self.interpolate(kind, pattern)
+                for pattern in getattr(self.script, kind).get(target, [])]
+
+    def signature(self, target):
+        """
+        A hash of the target's body and the script's values for the
+        options it uses, so changed commands or options rebuild.
+        """
+        body = self.body_of_target(target)
+        options = [(name, self.script.options.get(name))
+                   for name in sorted(references(body))]
+        return hashlib.md5(repr((body, options))).hexdigest()
+
+    def up_to_date(self, target):
+        """
+        A target is up to date when it declares outputs that are all
+        newer than its inputs and its body hasn't changed since the
+        last time it ran.  Targets without outputs always run.
+        """
+        outputs = self.target_files(target, "outputs")
+        if not outputs or self.option("force"): return False
+        if self.signatures.get(target) != self.signature(target): return False
+
+        try:
+            inputs = self.target_files(target, "inputs")
+            self.stats.prime(outputs + inputs)
+            oldest = min(self.stats.getmtime(f) for f in outputs)
+            newest = max([self.stats.getmtime(f) for f in inputs] or [0])
+        except OSError:
+            return False  # something is missing, so build it
+
+        return newest <= oldest
+
+    ### @export "build cache keys"
+    def cache_key(self, target):
+        """
+        Makes the build cache key for a target out of the contents
+        of its inputs, its interpolated commands, and the options
+        those commands reference.  Returns None when the cache is
+        off or an input is missing.  Giving a remote_cache turns
+        the cache on.
+        """
+        if not (self.option("cache") or self.option("remote_cache")): 
+            return None
+
+        inputs = []
+        try:
+            for name in self.target_files(target, "inputs"):
+                with open(name, "rb") as f:
+                    inputs.append((name, hashlib.sha1(f.read()).digest()))
+        except IOError:
+            return None
+
         body = self.body_of_target(target)
-        self.execute(body)
+        commands = repr(body)
+        referenced = sorted(references(body))
+        options = [(name, self.option(name)) for name in referenced]
+        try:
+            commands = commands % self.options
+        except (KeyError, ValueError, TypeError):
+            pass  # things like forall's %(file)s only exist at run time
+
+        # the declared outputs, since before a build their globs
+        # only match whatever happens to be lying around
+        return self.cache.key(inputs, commands, options,
+                              self.target_patterns(target, "outputs"))
 
     ### @export "running all targets"
     def build(self, to_build):
@@ -157,25 +423,159 @@ class Scribe(object):
         """
         building = self.script.resolve_targets(to_build)
         self.log("BUILDING: %s" % building)
-        for target in building:
+        self.stats.clear()  # files could have changed since the last build
+        self.ledger.begin(self.refingerprint)
+        jobs = self.option("jobs")
+        try:
+            if self.option("async"):
+                self.build_async(building, int(jobs or 0))
+            elif int(jobs or 1) > 1:
+                self.build_parallel(building, int(jobs))
+            else:
+                for target in building:
+                    self.log("-->: %s" % target)
+                    self.transition(target)
+        finally:
+            self.signatures.save()
+            self.files.save()
+            self.manifests.save()
+
+    ### @export "running targets in parallel"
+    def build_parallel(self, building, jobs):
+        """
+        Runs the targets in building on a pool of jobs threads.
+        Each target starts as soon as everything it depends on
+        is done, so independent branches of the graph overlap.
+        A target that uses cd changes the directory for every
+        thread, so it only starts once nothing else is running and
+        nothing else starts until it's done.  The first failure
+        stops new targets from starting and is raised once the
+        running ones finish.
+        """
+        from multiprocessing.pool import ThreadPool
+        schedule = Schedule(self.script.dag(building), building)
+        ready = list(schedule.ready)
+        done = Queue.Queue()
+        pool = ThreadPool(jobs)
+        running = [0]
+        alone = [False]
+
+        def start():
+            while ready and not alone[0]:
+                if self.changes_dir(ready[0]):
+                    if running[0]: return
+                    alone[0] = True
+                target = ready.pop(0)
+                self.log("-->: %s" % target)
+                running[0] += 1
+                pool.apply_async(self.run_target, (target,), 
+                                 callback=done.put)
+
+        failed = None
+        try:
+            start()
+            while running[0]:
+                target, err = done.get()
+                running[0] -= 1
+                alone[0] = False
+                if err:
+                    failed = failed or err
+                elif not failed:
+                    ready.extend(schedule.finished(target))
+                    start()
+        finally:
+            pool.close()
+            pool.join()
+
+        if failed: raise failed
+
+    def changes_dir(self, target, seen=None):
+        """
+        Tells if a target, or one it needs, runs a cd anywhere in
+        its body (like in a forall's do block).
+        """
+        seen = seen or set()
+        seen.add(target)
+
+        def uses_cd(body):
+            if isinstance(body, Reference):
+                if body.name == "cd": return True
+                if body.name == "needs":
+                    return [t for t in body.expr if t not in seen and
+                            self.is_target(t) and self.changes_dir(t, seen)] != []
+                return uses_cd(body.expr)
+            elif isinstance(body, dict):
+                return [v for v in body.values() if uses_cd(v)] != []
+            elif isinstance(body, (list, tuple)):
+                return [v for v in body if uses_cd(v)] != []
+            return False
+
+        return self.is_target(target) and uses_cd(self.body_of_target(target))
+
+    def build_async(self, building, jobs=0):
+        """
+        Runs the targets in building on an Engine, which runs all of
+        their shell lines from this one thread and streams their
+        output.  Like build_parallel targets start when their
+        depends are done, and jobs limits how many commands run at
+        once (0, when jobs isn't set, is no limit).  The first
+        failure kills the rest.
+        """
+        schedule = Schedule(self.script.dag(building), building)
+        engine = Engine(jobs)
+        failed = []
+
+        def start(target):
             self.log("-->: %s" % target)
-            self.transition(target)
+            worker = self.fork()
+            worker.engine = engine
+            engine.add(worker, worker.target_steps(target),
+                       lambda err: finished(target, err))
+
+        def finished(target, err):
+            if err:
+                failed.append(err)
+                engine.cancel()
+            elif not failed:
+                for after in schedule.finished(target):
+                    start(after)
+
+        for target in schedule.ready:
+            start(target)
+        engine.run()
+
+        if failed: raise failed[0]
+
+    def run_target(self, target):
+        """
+        Used by the build_parallel workers to transition to a target
+        with a forked Scribe.  Returns (target, error) since
+        exceptions don't make it back out of the pool.
+        """
+        try:
+            self.fork().transition(target)
+            return target, None
+        except Exception, err:
+            return target, err
 
     ### @export "string handling"
     def interpolate(self, cmd_name, expr):
         """
         Takes a string expression and interpolates it
         using the self.options dict as the % paramter.
-        It prints more useful errors than you'd normally
-        get from Python.
+        Strings are compiled into a Template the first time
+        they're seen, so after that only the keys they use
+        are looked up.  It prints more useful errors than
+        you'd normally get from Python.
         """
-        err_name = "%s %r" % (cmd_name, expr)
         try:
-            return expr % self.options
+            return template(expr).render(self.options)
         except ValueError, err:
-            self.die(err_name, "Expression has invalid format: %s" % err)
+            self.die("%s %r" % (cmd_name, expr), "Expression has invalid format: %s" % err)
         except KeyError, err:
-            self.die(err_name, "No key %s for format, available keys are: %r" % (err, sorted(self.options.keys())))
+            close = difflib.get_close_matches(str(err.args[0]), self.options.keys())
+            hint = close and "did you mean %s?" % ", ".join(close) or "use -T to list the options."
+            self.die("%s %r" % (cmd_name, expr), "No key %s for format, %s" % (err, hint))
 
     ### @export "scope management"
     def push_scope(self, vars={}):
@@ -184,11 +584,11 @@ class Scribe(object):
         an internal stack but with the new vars in the
         options for the next command to use.  This
         effectively emulates function call semantics for
-        targets.
+        targets.  The new scope is a Scope laid over the old one,
+        so this costs the same however many options there are.
         """
         self.stack.append(self.options)
-        self.options = self.options.copy()
-        self.options.update(vars)
+        self.options = Scope(dict(vars), self.options)
 
     def pop_scope(self):
         """
@@ -198,4 +598,36 @@ class Scribe(object):
         self.options = self.stack.pop()
 
 
+### @export "class Schedule"
+class Schedule(object):
+    """
+    Keeps track of which targets in a parallel build are ready
+    to run.  It starts with the targets that wait on nothing,
+    in building order, and finished() hands back the ones a
+    finished target was the last thing holding up.
+    """
+
+    def __init__(self, graph, building):
+        self.waiting = {}
+        self.dependents = {}
+        for target, deps in graph.items():
+            self.waiting[target] = set(deps)
+            for dep in self.waiting[target]:
+                self.dependents.setdefault(dep, []).append(target)
+
+        self.ready = []
+        seen = set()
+        for target in building:
+            if not (self.waiting[target] or target in seen):
+                seen.add(target)
+                self.ready.append(target)
+
+    def finished(self, target):
+        """Returns the targets that can start now that target is done."""
+        ready = []
+        for after in self.dependents.get(target, []):
+            self.waiting[after].discard(target)
+            if not self.waiting[after]:
+                ready.append(after)
+        return ready
 
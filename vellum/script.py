@@ -4,6 +4,88 @@ from vellum.press import Press
 from pprint import pprint
 from vellum import ImportError
 
+class CycleError(ImportError): pass
+
+### @export "class Graph"
+class Graph(object):
+    """
+    The dependency graph from the depends stanza.  It works out
+    build orders with one iterative depth first walk, so every
+    target and edge is visited once no matter how many diamonds
+    the graph has, and a cycle is reported instead of recursing
+    until the stack blows.  Orders are remembered per root, and
+    all_orders() works them out for every target with one walk.
+    """
+
+    def __init__(self, depends):
+        self.depends = depends
+        self.orders = {}
+
+    def reset(self):
+        """Forgets the remembered orders after depends changes."""
+        self.orders = {}
+
+    def order(self, root):
+        """Returns root's dependencies in build order followed by root."""
+        if root not in self.orders:
+            self.orders[root] = self.resolve([root])
+        return self.orders[root]
+
+    def all_orders(self, roots):
+        """
+        Walks once from all of the roots and returns a dict with the
+        order of every target reached.  Each one's order is made from
+        the orders of its depends, which the walk always finishes
+        first, and comes out the same as resolve([target]) would.
+        They aren't remembered since together they can be far
+        bigger than the graph.
+        """
+        orders = {}
+        for target in self.resolve(roots):
+            order, seen = [], set()
+            for dep in self.depends.get(target, []):
+                for before in orders[dep]:
+                    if before not in seen:
+                        seen.add(before)
+                        order.append(before)
+            order.append(target)
+            orders[target] = order
+        return orders
+
+    ### @export "the walk"
+    def resolve(self, roots):
+        """
+        Walks the graph from each of the roots in turn, listing every
+        target after the ones it depends on and only the first
+        time it's reached.
+        """
+        building = []
+        done = set()
+        for root in roots:
+            if root in done: continue
+            path = [root]
+            on_path = set(path)
+            stack = [iter(self.depends.get(root, []))]
+            while stack:
+                for dep in stack[-1]:
+                    if dep in done: continue
+                    if dep in on_path:
+                        cycle = path[path.index(dep):] + [dep]
+                        raise CycleError("Dependency cycle: %s" % 
+                                         " -> ".join(cycle))
+                    path.append(dep)
+                    on_path.add(dep)
+                    stack.append(iter(self.depends.get(dep, [])))
+                    break
+                else:
+                    stack.pop()
+                    target = path.pop()
+                    on_path.discard(target)
+                    done.add(target)
+                    building.append(target)
+        return building
+### @end
+
 class Script(object):
     """
     Uses Press to parse the build spec and then constructs
@@ -24,23 +106,43 @@ class Script(object):
                                   "the root of your vellum spec." % key)
         self.__dict__.update(press.main)
         self.options.update(defaults)
+        self.__dict__.setdefault("depends", {})
+        self.__dict__.setdefault("inputs", {})
+        self.__dict__.setdefault("outputs", {})
+        self.graph = Graph(self.depends)
+        self.press = press
+        self.stats = press.stats
+        self.file = file
+        self.defaults = defaults
+
+    ### @export "refreshing"
+    def refresh(self):
+        """
+        Has the press splice any changes to the recipes into the
+        spec this script already has, then makes the graph forget
+        its build orders.  If the press can't do that (say the
+        imports changed) the whole script is loaded again.  Returns
+        the list of changed entries, or None after a full reload.
+        """
+        changed = self.press.refresh()
+        if changed is None:
+            file, defaults = self.file, self.defaults
+            self.__dict__.clear()
+            self.__init__(file, defaults)
+        elif changed:
+            self.__dict__.update(self.press.main)
+            self.options.update(self.defaults)
+            self.graph.depends = self.depends
+            self.graph.reset()
+        return changed
 
     ### @export "resolve_depends"
     def resolve_depends(self, root):
         """
-        Recursively resolves the dependencies for the root
-        target given and return a list with those followed
-        by the root.
+        Resolves the dependencies for the root target given
+        and returns a list with those followed by the root.
         """
-        building = []
-        if root in self.depends:
-            for dep in self.depends[root]:
-                if dep in self.depends and not dep in building:
-                    building.extend(self.resolve_depends(dep))
-                else:
-                    building.append(dep)
-        building.append(root)
-        return building
+        return list(self.graph.order(root))
     ### @end
 
     def show(self):
@@ -53,9 +155,9 @@ class Script(object):
         print "\nTARGETS:"
         # some targets are only in depends
         keys = set(self.targets.keys() + self.depends.keys())
+        orders = self.graph.all_orders(sorted(keys))
         for target in sorted(keys):
-            building = self.resolve_depends(target)
-            print "%s:\t%s" % (target, repr(building))
+            print "%s:\t%s" % (target, repr(orders[target]))
         print "\nDEFAULT: %s" % self.options.get("default", "None")
 
     ### @export "reducing targets"
@@ -77,12 +179,22 @@ class Script(object):
         """
         if not to_build: 
             if "default" not in self.options:
-                raise("You forgot to specify a default target and didn't give one on the command line.")
+                raise ImportError("You forgot to specify a default target and didn't give one on the command line.")
             else:
                 return self.resolve_depends(self.options["default"])
         else:
-            building = []
-            for target in to_build:
-                building.extend(self.resolve_depends(target))
-            return self.reduce_targets(building)
+            return self.graph.resolve(to_build)
+
+    ### @export "building the dag"
+    def dag(self, building):
+        """
+        Takes a list of targets from resolve_targets and returns
+        a dict mapping each one to the targets it has to wait for.
+        Scribe uses this to run independent targets at once.
+        """
+        graph = {}
+        for target in building:
+            graph[target] = [dep for dep in self.depends.get(target, [])
+                             if dep != target]
+        return graph
 
@@ -0,0 +1,144 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+import errno
+import fcntl
+import os
+import re
+import shlex
+import subprocess
+
+# any of these in a line means it needs a real shell
+SHELL_CHARS = re.compile(r"[|&;<>()$`*?\[\]{}~!#\n]")
+
+# and so does starting with one of these
+SHELL_WORDS = set(["cd", "export", "unset", "set", "exit", "exec", "eval",
+                   "source", ".", ":", "alias", "umask", "ulimit", "read",
+                   "wait", "trap", "shift", "return", "break", "continue",
+                   "readonly", "local", "type", "command", "hash", "times",
+                   "getopts", "if", "for", "while", "until", "case", "function"])
+
+def quote(text):
+    """Quotes text so /bin/sh sees it as one literal word."""
+    return "'%s'" % text.replace("'", "'\\''")
+
+### @export "running without a shell"
+def plain_argv(cmd):
+    """
+    Splits cmd into an argv list when it's a plain program and
+    arguments that don't need anything from the shell: no pipes,
+    redirects, globs, substitutions, variables or builtins.
+    Returns None when cmd has to go through /bin/sh.
+    """
+    if SHELL_CHARS.search(cmd): return None
+    try:
+        argv = shlex.split(cmd)
+    except ValueError:
+        return None
+    if not argv or argv[0] in SHELL_WORDS or "=" in argv[0]:
+        return None
+    return argv
+
+def call(argv):
+    """
+    Execs argv directly, returning the same status /bin/sh would:
+    127 when the program isn't found and 126 when it can't run.
+    """
+    try:
+        return subprocess.call(argv, stdout=1, stderr=1)
+    except OSError, err:
+        return 127 if err.errno == errno.ENOENT else 126
+
+def capture(cmd, out):
+    """
+    Runs cmd (an argv, or a string for /bin/sh) with its stdout
+    and stderr written to out, returning the exit status like
+    call() does.
+    """
+    try:
+        proc = subprocess.Popen(cmd, shell=isinstance(cmd, basestring),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError, err:
+        return 127 if err.errno == errno.ENOENT else 126
+    out.write(proc.communicate()[0])
+    return proc.returncode
+
+# where the shell finds the status pipe
+STATUS_FD = 3
+
+### @export "class Shell"
+class Shell(object):
+    """
+    One long-lived /bin/sh that a target's shell lines are streamed
+    into, so each line doesn't pay for a new process and things like
+    cd or exported variables carry over from line to line.
+
+    Each line is handed to eval so a syntax error can't get the
+    shell out of step with us, and afterwards the shell writes the
+    exit status to a private pipe, leaving stdout and stderr alone.
+    Lines don't get stdin since that's how the shell is fed.
+    """
+
+    def __init__(self, shell="/bin/sh"):
+        self.shell = shell
+        self.proc = None
+        self.cwd = None
+
+    def start(self):
+        """Starts the shell with the write end of the status pipe."""
+        status, self.fd = os.pipe()
+        for fd in (status, self.fd):
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
+        def keep_status():
+            # dash can't redirect fds past 9, so it always gets fd 3
+            os.dup2(self.fd, STATUS_FD)
+            fcntl.fcntl(STATUS_FD, fcntl.F_SETFD, 0)
+
+        self.proc = subprocess.Popen([self.shell], stdin=subprocess.PIPE,
+                                     stdout=1, stderr=1, close_fds=False,
+                                     preexec_fn=keep_status)
+        os.close(self.fd)
+        self.status = os.fdopen(status)
+        self.cwd = None
+
+    def run(self, cmd):
+        """
+        Runs one command line in the shell and returns its exit status.
+        If our own directory changed since the last line (the cd
+        command does that) the shell follows it first.  A line that
+        exits the shell returns the shell's status and the next line
+        gets a fresh shell.
+        """
+        if not self.proc: self.start()
+
+        script = []
+        cwd = os.getcwd()
+        if cwd != self.cwd:
+            script.append("cd %s" % quote(cwd))
+            self.cwd = cwd
+        script.append("eval %s </dev/null %d>&-" % (quote(cmd), STATUS_FD))
+        script.append("echo $? >&%d\n" % STATUS_FD)
+
+        try:
+            self.proc.stdin.write("\n".join(script))
+            self.proc.stdin.flush()
+            status = self.status.readline()
+        except IOError:
+            status = ""
+
+        if status:
+            return int(status)
+        else:
+            return self.close()
+
+    def close(self):
+        """Ends the shell, returning its exit status."""
+        if not self.proc: return 0
+        try:
+            self.proc.stdin.close()
+        except IOError:
+            pass
+        retcode = self.proc.wait()
+        self.status.close()
+        self.proc = None
+        return retcode
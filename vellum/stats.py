@@ -0,0 +1,127 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+import errno
+import fnmatch
+import glob
+import os
+import stat
+
+### @export "class StatCache"
+class StatCache(object):
+    """
+    One place to ask the file system about files, remembering the
+    answers so a big forall or a long list of inputs doesn't stat
+    the same paths over and over.  Press makes it and Script and
+    every Scribe share it, and py and given code gets it as stats.
+
+    Directory listings are remembered too (forall hands over the
+    ones it walks), and once a directory is listed whether a file
+    in it exists is answered without a stat at all.  Paths are kept
+    absolute against the directory the cache thinks it's in, so
+    change directories with chdir() rather than os.chdir().
+
+    Scribe clears it when a build starts and forgets what a command
+    could have changed after sh and gen run.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.listings = {}
+        self.cwd = os.getcwd()
+
+    def key(self, path):
+        return os.path.normpath(os.path.join(self.cwd, path))
+
+    def stat(self, path):
+        """Returns os.stat() of path, or None if it isn't there."""
+        key = self.key(path)
+        try:
+            return self.stats[key]
+        except KeyError:
+            pass
+
+        dir, name = os.path.split(key)
+        if dir in self.listings and name not in self.listings[dir]:
+            st = None
+        else:
+            try:
+                st = os.stat(key)
+            except OSError:
+                st = None
+        self.stats[key] = st
+        return st
+
+    def exists(self, path):
+        key = self.key(path)
+        dir, name = os.path.split(key)
+        if key not in self.stats and dir in self.listings:
+            return name in self.listings[dir]
+        return self.stat(key) is not None
+
+    def isdir(self, path):
+        st = self.stat(path)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def isfile(self, path):
+        st = self.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def getmtime(self, path):
+        """Like os.path.getmtime, raising OSError if it's missing."""
+        st = self.stat(path)
+        if st is None:
+            raise OSError(errno.ENOENT, "No such file or directory", path)
+        return st.st_mtime
+
+    ### @export "batches"
+    def listdir(self, dir):
+        """The names in dir (empty if it's missing), listed only once."""
+        key = self.key(dir)
+        if key not in self.listings:
+            try:
+                self.listings[key] = set(os.listdir(key))
+            except OSError:
+                self.listings[key] = set()
+        return self.listings[key]
+
+    def listed(self, dir, names):
+        """Remembers a listing someone else already did, like os.walk."""
+        self.listings[self.key(dir)] = set(names)
+
+    def prime(self, paths):
+        """
+        Stats a batch of paths, first listing each directory that
+        has more than one of them so the missing ones don't need a
+        stat of their own.
+        """
+        dirs = [os.path.dirname(self.key(p)) for p in paths]
+        for dir in set(dirs):
+            if dirs.count(dir) > 1: self.listdir(dir)
+        for path in paths:
+            self.stat(path)
+
+    ### @export "invalidation"
+    def chdir(self, path):
+        os.chdir(path)
+        self.cwd = os.getcwd()
+
+    def forget(self, paths):
+        """
+        Drops what's known about each path (globs are fine) along with
+        the stat and listing of the directory it's in, since a new or
+        removed file changes those too.
+        """
+        for path in paths:
+            key = self.key(path)
+            dir = os.path.dirname(key)
+            for known, keys in ((self.stats, [key, dir]), (self.listings, [key, dir])):
+                for pattern in keys:
+                    if glob.has_magic(pattern):
+                        for name in fnmatch.filter(known.keys(), pattern):
+                            known.pop(name, None)
+                    else:
+                        known.pop(pattern, None)
+
+    def clear(self):
+        self.stats.clear()
+        self.listings.clear()
@@ -0,0 +1,60 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from __future__ import with_statement
+import os
+import cPickle as pickle
+
+class Store(object):
+    """
+    A small dict that is pickled into the project's .vellum
+    directory so that things like target signatures survive
+    between runs.  Nothing is read until it's first used, and
+    save() only writes when something actually changed.
+    """
+
+    def __init__(self, name, root=".vellum"):
+        self.path = os.path.join(root, name)
+        self.data = None
+        self.dirty = False
+
+    def load(self):
+        """Loads the pickled dict, starting empty if it's missing or bad."""
+        if self.data is None:
+            try:
+                with open(self.path, "rb") as f:
+                    self.data = pickle.load(f)
+            except Exception:
+                self.data = {}
+        return self.data
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __setitem__(self, key, value):
+        self.load()[key] = value
+        self.dirty = True
+
+    def __delitem__(self, key):
+        del self.load()[key]
+        self.dirty = True
+
+    def __contains__(self, key):
+        return key in self.load()
+
+    def save(self):
+        """
+        Writes the dict out if it changed, going through a temp file
+        so an interrupted write never leaves a broken store behind.
+        """
+        if not self.dirty: return
+        root = os.path.dirname(self.path)
+        if root and not os.path.exists(root):
+            os.makedirs(root)
+        temp = "%s.%d" % (self.path, os.getpid())
+        with open(temp, "wb") as f:
+            pickle.dump(self.data, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp, self.path)
+        self.dirty = False
@@ -0,0 +1,120 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from vellum.parser import Reference
+from operator import itemgetter
+
+# what can come between a %(key) and its conversion character
+SPEC_CHARS = "#0- +123456789.hlL"
+CONVERSIONS = "diouxXeEfFgGcrs"
+
+# compiled templates by their text, dropped when there are too many
+TEMPLATES = {}
+MAX_TEMPLATES = 10000
+
+### @export "class Template"
+class Template(object):
+    """
+    A string to % interpolate with the options, compiled once.
+    keys are the option names it uses, and render() looks up just
+    those and formats them in by position, so a forall running the
+    same line for thousands of files doesn't redo any of the work.
+
+    Anything %(key)s style formatting doesn't cover, like a bare %s,
+    a broken format, or something that isn't a string, is left to
+    Python (whole is True) so it renders and fails exactly like
+    expr % options always did.
+    """
+
+    __slots__ = ("text", "keys", "names", "format", "whole", "render")
+
+    def __init__(self, text):
+        self.text = text
+        self.names = []
+        self.whole = not isinstance(text, basestring)
+        self.format = text if self.whole else self.compile(text)
+        self.keys = frozenset(self.names)
+        self.render = self.renderer()
+
+    def compile(self, text):
+        """
+        Turns text into a positional format, filling in names as
+        it goes.  Sets whole and gives up on anything unusual.
+        """
+        out = []
+        i = 0
+        while True:
+            j = text.find("%", i)
+            if j < 0:
+                out.append(text[i:])
+                return "".join(out)
+
+            out.append(text[i:j + 1])
+            k = j + 1
+            if text[k:k + 1] == "%":
+                out.append("%")
+                i = k + 1
+                continue
+            elif text[k:k + 1] != "(":
+                break  # unnamed, or % at the very end
+
+            depth, m = 1, k + 1
+            while m < len(text) and depth:
+                if text[m] == "(": depth += 1
+                elif text[m] == ")": depth -= 1
+                m += 1
+            if depth: break
+            self.names.append(text[k + 1:m - 1])
+
+            spec = m
+            while m < len(text) and text[m] in SPEC_CHARS: m += 1
+            if m >= len(text) or text[m] not in CONVERSIONS: break
+            out.append(text[spec:m + 1])
+            i = m + 1
+
+        self.whole = True
+        return text
+
+    def renderer(self):
+        """
+        Makes render(options), which interpolates the options and
+        raises what % would for a bad one.  It's picked for the
+        kind of template so the common ones do as little as they can.
+        """
+        text, format, names = self.text, self.format, self.names
+        if self.whole:
+            return lambda options: text % options
+        elif not names:
+            literal = format % ()
+            return lambda options: literal
+        elif len(names) == 1:
+            name = names[0]
+            return lambda options: format % (options[name],)
+        else:
+            get = itemgetter(*names)
+            return lambda options: format % get(options)
+
+def template(text):
+    """Gets the compiled Template for text, compiling it just once."""
+    try:
+        return TEMPLATES[text]
+    except KeyError:
+        if len(TEMPLATES) >= MAX_TEMPLATES: TEMPLATES.clear()
+        compiled = TEMPLATES[text] = Template(text)
+        return compiled
+
+### @export "references"
+def references(body):
+    """
+    Collects the option keys used by every string in a target's
+    body, looking inside command References and their dicts.
+    """
+    keys = set()
+    if isinstance(body, basestring):
+        keys.update(template(body).keys)
+    elif isinstance(body, Reference):
+        keys.update(references(body.expr))
+    elif isinstance(body, dict):
+        for value in body.values(): keys.update(references(value))
+    elif isinstance(body, (list, tuple)):
+        for value in body: keys.update(references(value))
+    return keys
@@ -0,0 +1,253 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from vellum.index import IGNORE, ignored
+from vellum.parser import Reference
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import os
+import select
+import struct
+import time
+
+# the inotify events that mean a file or directory changed
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+        IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+### @export "class Inotify"
+class Inotify(object):
+    """
+    Just enough of Linux's inotify, through ctypes, to watch a set
+    of directories.  Raises OSError or AttributeError when the
+    system doesn't have it so Watcher can poll instead.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.dirs = {}
+
+    def watch(self, dir):
+        wd = self.add_watch(self.fd, dir, MASK)
+        if wd >= 0: self.dirs[wd] = dir
+
+    def read(self, timeout):
+        """
+        Waits up to timeout for events and returns a set of the
+        paths they were about, or None if the kernel's queue
+        overflowed and anything could have changed.  New
+        directories are watched as they show up.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = struct.unpack_from("iIII", data, pos)
+            name = data[pos + 16:pos + 16 + size].rstrip("\0")
+            pos += 16 + size
+
+            if mask & IN_Q_OVERFLOW: return None
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            elif wd in self.dirs:
+                path = os.path.normpath(os.path.join(self.dirs[wd], name))
+                if (mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and
+                        not ignored(name, IGNORE)):
+                    for dir, files in walk(path):
+                        self.watch(dir)
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+### @export "class Poller"
+class Poller(object):
+    """Does what Inotify does by comparing stats of every file."""
+
+    def __init__(self):
+        self.dirs = []
+        self.stats = {}
+
+    def watch(self, dir):
+        self.dirs.append(dir)
+        self.stats.update(self.scan(dir))
+
+    def scan(self, dir):
+        stats = {}
+        for name in os.listdir(dir):
+            path = os.path.normpath(os.path.join(dir, name))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if ignored(name, IGNORE) and os.path.isdir(path):
+                stats[path] = None  # only coming and going, like inotify
+            else:
+                stats[path] = (st.st_mtime, st.st_size)
+        return stats
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        stats = {}
+        for dir in self.dirs:
+            if os.path.isdir(dir): stats.update(self.scan(dir))
+        changed = set([path for path in set(stats) | set(self.stats)
+                       if stats.get(path, 0) != self.stats.get(path, 0)])
+
+        for path in changed:
+            if (path in stats and path not in self.stats and os.path.isdir(path) and
+                    not ignored(os.path.basename(path), IGNORE)):
+                for dir, files in walk(path):
+                    self.dirs.append(dir)
+                    stats.update(self.scan(dir))
+        self.stats = stats
+        return changed
+
+    def close(self):
+        pass
+
+### @export "class Watcher"
+class Watcher(object):
+    """
+    Watches whole directory trees, using inotify where there is
+    one and polling where there isn't, and hands back the changed
+    paths one burst at a time: once something changes it keeps
+    collecting until nothing has changed for debounce seconds, so
+    an editor saving or a checkout touching many files only
+    causes one rebuild.  Give poll=True for file systems that
+    inotify can't see into, like NFS.
+    """
+
+    def __init__(self, roots, debounce=0.2, poll=False):
+        self.debounce = debounce
+        try:
+            self.backend = Poller() if poll else Inotify()
+        except (OSError, AttributeError):
+            self.backend = Poller()
+        for root in roots:
+            for dir, files in walk(root):
+                self.backend.watch(dir)
+
+    def wait(self, timeout):
+        """
+        Returns the set of paths changed in the next burst, an empty
+        set if nothing changed within timeout, or None if there's
+        no telling what changed.
+        """
+        changed = self.backend.read(timeout)
+        while changed:
+            more = self.backend.read(self.debounce)
+            if more is None: return None
+            if not more: break
+            changed |= more
+        return changed
+
+    def close(self):
+        self.backend.close()
+
+def walk(root):
+    """Lists each directory under root with its files, skipping IGNORE."""
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not ignored(d, IGNORE)]
+        yield path, files
+
+### @export "what to watch"
+def spec_root(spec):
+    """The directory to watch for a file, directory, or glob."""
+    parts = []
+    for part in spec.split(os.sep):
+        if glob.has_magic(part): break
+        parts.append(part)
+    root = os.sep.join(parts) or "."
+    if os.path.isdir(root):
+        return root
+    return os.path.dirname(root) or "."
+
+def matches(spec, path):
+    """Tells if a changed path is one a file, directory, or glob means."""
+    spec = os.path.normpath(spec)
+    if glob.has_magic(spec):
+        return fnmatch.fnmatch(path, spec)
+    return path == spec or path.startswith(spec + os.sep) or spec == "."
+
+### @export "targeted rebuilds"
+def triggers(scribe, target):
+    """
+    Lists what changes make target worth building again: a
+    ("inputs", pattern) for each of its declared inputs and a
+    (top, files) for each forall in its body, including in the
+    targets it needs.
+    """
+    found = [("inputs", os.path.normpath(scribe.interpolate("inputs", pattern)))
+             for pattern in scribe.script.inputs.get(target, [])]
+
+    def search(body, seen):
+        if isinstance(body, (list, tuple)):
+            for cmd in body: search(cmd, seen)
+        elif isinstance(body, Reference):
+            expr = body.expr
+            if body.name == "forall" and isinstance(expr, dict) and expr.get("files"):
+                found.append((expr.get("top", "."), expr["files"]))
+            if body.name == "needs":
+                for name in (expr if isinstance(expr, (list, tuple)) else [expr]):
+                    if name not in seen:
+                        seen.add(name)
+                        search(scribe.script.targets.get(name), seen)
+            elif isinstance(expr, dict):
+                search(expr.get("do"), seen)
+
+    search(scribe.script.targets.get(target), set([target]))
+    return found
+
+def triggered(trigger, path):
+    """Tells if a changed path matches one of the triggers()."""
+    where, pattern = trigger
+    if where == "inputs":
+        return fnmatch.fnmatch(path, pattern)
+    rel = os.path.relpath(path, where)
+    return not rel.startswith("..") and fnmatch.fnmatch(os.path.join(where, rel), pattern)
+
+def affected(scribe, targets, changed):
+    """
+    Picks out which of the targets (or the default) have to be
+    built again for the changed paths.  A target is affected when
+    a change matches a trigger of anything it depends on.  Changes
+    to declared outputs are left out since building makes those,
+    and targets that declare nothing at all are always affected
+    since there's no telling what they read.
+    """
+    script = scribe.script
+    outputs = [os.path.normpath(scribe.interpolate("outputs", pattern))
+               for patterns in script.outputs.values() for pattern in patterns]
+    changed = [path for path in changed
+               if not [p for p in outputs if fnmatch.fnmatch(path, p)]]
+    if not changed: return []
+
+    roots = targets or [script.options["default"]]
+    building = []
+    for root in roots:
+        found = []
+        for target in script.resolve_targets([root]):
+            found.extend(triggers(scribe, target))
+        if not found or [t for t in found for p in changed if triggered(t, p)]:
+            building.append(root)
+    return building
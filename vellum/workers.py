@@ -0,0 +1,188 @@
+# Copyright (C) 2008 Zed A. Shaw.  Licensed under the terms of the GPLv3.
+
+from vellum import DieError
+from vellum.parser import Reference
+from StringIO import StringIO
+import Queue
+import os
+import select
+import sys
+import threading
+import traceback
+
+# commands that are safe to run on threads: they only start
+# processes or print, and never touch the scope, cwd, or globals
+THREADED = ["sh", "log"]
+
+### @export "picking threads or processes"
+def shell_only(scribe, body):
+    """
+    Tells if a do block is only shell lines and the THREADED
+    commands, which spend their time waiting on processes so
+    threads run them just as fast.  Anything else, like py or
+    cd, gets a process of its own.
+    """
+    if scribe.option("persistent"): return False
+    for cmd in scribe.parse_target(body):
+        if isinstance(cmd, Reference) and cmd.name not in THREADED:
+            return False
+    return True
+
+def run_each(scribe, files, jobs, do, scope, done=None):
+    """
+    Runs the do block for each of the files, jobs at a time, on
+    threads or forked processes as shell_only() says, pushing the
+    vars scope(file) gives.  What each one prints is written out
+    in one piece when it's done so they never interleave, and
+    then done(file, ok) is called if it's given.  Returns the
+    number of files that failed, and after the first failure no
+    more are started unless keep_going is on.
+    """
+    done = done or (lambda file, ok: None)
+    if shell_only(scribe, do):
+        return threaded(scribe, files, jobs, do, scope, done)
+    else:
+        return forked(scribe, files, jobs, do, scope, done)
+
+### @export "threads"
+def threaded(scribe, files, jobs, do, scope, done):
+    """Runs each file on one of jobs threads with a forked Scribe."""
+    work = Queue.Queue(jobs)  # bounded, so a streamed forall stays small
+    results = Queue.Queue()
+    failed = [0]
+    stop = []  # set by the first failure unless keep_going is on
+
+    def worker():
+        while True:
+            file = work.get()
+            if file is None: break
+            if stop: continue
+
+            run = scribe.fork()
+            run.options, run.target, run.line = scribe.options, scribe.target, scribe.line
+            run.output = StringIO()
+            run.push_scope(scope(file))
+            try:
+                run.execute(do)
+            except DieError, err:
+                run.output.write("ERROR: %s\n" % err)
+                run.errors += 1
+            except Exception:
+                run.output.write(traceback.format_exc())
+                run.errors += 1
+            if run.errors and not scribe.option("keep_going"): stop.append(file)
+            results.put((file, run.output.getvalue(), run.errors))
+
+    def finished(timeout):
+        try:
+            file, output, errors = results.get(timeout > 0, timeout)
+        except Queue.Empty:
+            return False
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        if errors: failed[0] += 1
+        done(file, not errors)
+        return True
+
+    threads = [threading.Thread(target=worker) for i in range(jobs)]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    try:
+        for file in files:
+            if stop: break
+            work.put(file)
+            while finished(0): pass
+    finally:
+        for thread in threads: work.put(None)
+    while [thread for thread in threads if thread.isAlive()]:
+        finished(0.1)
+    while finished(0): pass
+    return failed[0]
+
+### @export "processes"
+def forked(scribe, files, jobs, do, scope, done):
+    """
+    Runs each file in a forked child with its stdout and stderr on
+    a pipe, so a py or cd in one can't change another's scope or
+    working directory.  What the children do to the ledger and
+    signatures stays in them.
+    """
+    running = {}
+    failed = 0
+    files = iter(files)
+    more = True
+
+    while more or running:
+        while more and len(running) < jobs:
+            if failed and not scribe.option("keep_going"):
+                more = False
+                break
+            try:
+                file = files.next()
+            except StopIteration:
+                more = False
+                break
+            fd, pid = spawn(scribe, do, scope(file))
+            running[fd] = (pid, file, [])
+
+        if not running: break
+        for fd in select.select(running.keys(), [], [])[0]:
+            pid, file, output = running[fd]
+            data = os.read(fd, 4096)
+            if data:
+                output.append(data)
+                continue
+
+            os.close(fd)
+            del running[fd]
+            status = os.waitpid(pid, 0)[1]
+            sys.stdout.write("".join(output))
+            sys.stdout.flush()
+            if status: failed += 1
+            done(file, not status)
+
+    scribe.invalidate()  # the children could have changed anything
+    return failed
+
+def spawn(scribe, do, vars):
+    """
+    Forks a child that runs do with vars pushed on its scope, exiting
+    with 1 if it failed.  Returns the pipe its output comes down
+    and its pid.  Everything the child prints goes down the pipe,
+    whatever sys.stdout was in the parent.
+    """
+    read, write = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        os.close(write)
+        return read, pid
+
+    status = 1
+    try:
+        os.close(read)
+        os.dup2(write, 1)
+        os.dup2(write, 2)
+        os.close(write)
+        # under the daemon these are the client's socket, not fds 1 and 2
+        sys.stdout = os.fdopen(1, "w")
+        sys.stderr = os.fdopen(2, "w", 0)
+        scribe.output = None
+        scribe.shell = None  # the parent's, so this one gets its own
+        errors = scribe.errors
+        scribe.push_scope(vars)
+        try:
+            scribe.execute(do)
+        except DieError, err:
+            print "ERROR: %s" % err
+        else:
+            if errors == scribe.errors: status = 0
+        if scribe.shell: scribe.shell.close()
+    except:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)